@@ -0,0 +1,66 @@
+'''
+Transfer backends benchmark
+
+Serves generated files from the local Connections stand-in and downloads
+them with every available transfer backend.
+
+Usage:
+    bench_backends.py [--files=N] [--size=BYTES] [--workers=N]
+    bench_backends.py -h | --help
+
+Options:
+    --files=N       Set the number of files to download (by default, 500)
+    --size=BYTES    Set the size of every file in bytes (by default, 65536)
+    --workers=N     Set the number of transfer workers (by default, 8)
+    -h, --help      Show this help message.
+'''
+
+from benchmarks import mock_connections as mock
+from w3cpull import transfer
+from docopt import docopt
+import tempfile
+import shutil
+import time
+import os
+
+
+def run(backend, urls, workers):
+    path = tempfile.mkdtemp(prefix="w3cpull-bench-")
+    try:
+        engine = transfer.init(workers, backend)
+        start_time = time.time()
+        for url in urls:
+            engine.submit(url, path)
+        engine.join()
+        elapsed = time.time() - start_time
+        engine.close()
+        return elapsed, len(os.listdir(path))
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    args = docopt(__doc__)
+    files = int(args['--files'] or 500)
+    size = int(args['--size'] or 65536)
+    workers = int(args['--workers'] or 8)
+
+    # A single page that links every file
+    server = mock.MockConnections(mock.generate(1, 1, files, 0, size))
+    urls = [server.file_url(wiki, page, name) for wiki, page, name in server.model["files"]]
+    try:
+        for backend in transfer.BACKENDS:
+            try:
+                elapsed, done = run(backend, urls, workers)
+            except RuntimeError as e:
+                print("{:<8} skipped: {}".format(backend, e))
+                continue
+            print("{:<8} {:>6} files  {:>8.2f} s  {:>9.1f} files/s  {:>8.2f} MB/s".format(
+                backend, done, elapsed, done / elapsed, done * size / elapsed / 2 ** 20
+            ))
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
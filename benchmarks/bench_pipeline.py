@@ -0,0 +1,138 @@
+'''
+End-to-end pipeline benchmark
+
+Pulls a synthetic community from the local Connections stand-in and
+measures pages/s and MB/s of the downloader and of the link rewriting.
+Without --browser the downloader runs as with --direct-export, with a
+stub in place of the browser, so no browser is needed.
+
+Usage:
+    bench_pipeline.py [--depth=N] [--width=N] [--links=N] [--attachments=N] [--size=BYTES] [--subcommunities=N] [--workers=N] [--io-backend=BACKEND] [--browser=BROWSER] [--rewrite-files=N]
+    bench_pipeline.py -h | --help
+
+Options:
+    --depth=N               Set the depth of the wiki tree (by default, 2)
+    --width=N               Set the number of child pages of every wiki page (by default, 4)
+    --links=N               Set the number of linked files on every page (by default, 8)
+    --attachments=N         Set the number of attachments of every page (by default, 4)
+    --size=BYTES            Set the size of every file in bytes (by default, 65536)
+    --subcommunities=N      Set the number of subcommunities of the root community (by default, 2)
+    --workers=N             Set the number of transfer workers (by default, 8)
+    --io-backend=BACKEND    Set the transfer engine: thread or async (by default, thread)
+    --browser=BROWSER       Drive the whole pipeline with this browser instead of plain HTTP
+    --rewrite-files=N       Set the number of pages for the link rewriting benchmark (by default, 2000)
+    -h, --help              Show this help message.
+'''
+
+from benchmarks import mock_connections as mock
+from w3cpull import downloader as down
+from w3cpull import modifier as mod
+from w3cpull import w3cpull as cli
+from w3cpull import transfer
+from w3cpull import paths
+from docopt import docopt
+import logging as log
+import requests
+import tempfile
+import shutil
+import time
+import os
+
+
+def report(name, pages, size, elapsed):
+    print("{:<20} {:>6} pages  {:>8.2f} s  {:>9.1f} pages/s  {:>8.2f} MB/s".format(
+        name, pages, elapsed, pages / elapsed, size / elapsed / 2 ** 20
+    ))
+
+
+class StubDriver:
+    # Only gives the session cookies, a page that falls back to the browser fails the benchmark
+    def get_cookies(self):
+        return []
+
+
+def pull_http(server, target_dir, workers, backend):
+    # The same engines and pipeline as a pull with --direct-export
+    path_index = paths.PathIndex()
+    loader = down.Downloader(
+        transfer.init(workers, backend, paths=path_index), mod.Rewriter(index=path_index),
+        path_index=path_index, direct_export=True
+    )
+    try:
+        tree = loader.create_fs_tree(target_dir, server.communities_tree())
+        loader.download_community(StubDriver(), tree, target_dir)
+    finally:
+        loader.finish()
+
+
+def pull_browser(server, target_dir, workers, backend, browser):
+    with cli.Puller(target_dir, browser=browser, download_workers=workers, io_backend=backend) as puller:
+        puller.pull(server.community_url())
+
+
+def bench_downloader(server, workers, backend, browser):
+    target_dir = tempfile.mkdtemp(prefix="w3cpull-bench-")
+    before = server.stats
+    try:
+        start_time = time.time()
+        if browser == None:
+            pull_http(server, target_dir, workers, backend)
+        else:
+            pull_browser(server, target_dir, workers, backend, browser)
+        elapsed = time.time() - start_time
+    finally:
+        shutil.rmtree(target_dir)
+    report("downloader", len(server.model["pages"]), server.stats["bytes"] - before["bytes"], elapsed)
+
+
+def bench_replace_links(server, files):
+    # Every run gets fresh copies, rewritten pages would have nothing left to replace
+    wiki, page = next(iter(server.model["pages"]))
+    content = requests.get(server.base_url + mock.EXPORT_PATH.format(wiki=wiki, page=page)).content
+    fd, source = tempfile.mkstemp(prefix="w3cpull-bench-", suffix=".html")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    size = len(content)
+    try:
+        for name, workers in (("replace_links serial", 1), ("replace_links", None)):
+            path = tempfile.mkdtemp(prefix="w3cpull-bench-")
+            try:
+                for i in range(files):
+                    shutil.copyfile(source, os.path.join(path, "page-{}.html".format(i)))
+                start_time = time.time()
+                mod.replace_links(path, workers)
+                report(name, files, files * size, time.time() - start_time)
+            finally:
+                shutil.rmtree(path)
+    finally:
+        os.remove(source)
+
+
+def main():
+    args = docopt(__doc__)
+    log.getLogger().setLevel(log.WARNING)
+
+    model = mock.generate(
+        int(args['--depth'] or 2),
+        int(args['--width'] or 4),
+        int(args['--links'] or 8),
+        int(args['--attachments'] or 4),
+        int(args['--size'] or 65536),
+        int(args['--subcommunities'] or 2),
+    )
+    server = mock.MockConnections(model)
+    try:
+        print("{} pages, {} files of {} bytes".format(len(model["pages"]), len(model["files"]), model["size"]))
+        bench_downloader(
+            server,
+            int(args['--workers'] or transfer.DEFAULT_WORKERS),
+            args['--io-backend'] or transfer.DEFAULT_BACKEND,
+            args['--browser'],
+        )
+        bench_replace_links(server, int(args['--rewrite-files'] or 2000))
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
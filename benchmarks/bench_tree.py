@@ -0,0 +1,87 @@
+'''
+Structure tree benchmark
+
+Builds a synthetic structure tree with many wikis and measures the memory
+and time of planning its local paths and of the tree cache, next to the
+nested dictionaries with a path per wiki that the tree replaces.
+
+Usage:
+    bench_tree.py [--wikis=N] [--width=N]
+    bench_tree.py -h | --help
+
+Options:
+    --wikis=N       Set the number of wiki pages (by default, 200000)
+    --width=N       Set the number of child pages of every wiki page (by default, 10)
+    -h, --help      Show this help message.
+'''
+
+from w3cpull import paths
+from w3cpull import tree as tr
+from docopt import docopt
+import tracemalloc
+import tempfile
+import shutil
+import time
+import os
+
+URL = "https://connections.example.com/wikis/home/wiki/W{}/page/Page-{}"
+
+
+def measure(name, build):
+    tracemalloc.start()
+    start_time = time.time()
+    result = build()
+    elapsed = time.time() - start_time
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{:<24} {:>8.2f} s  {:>8.1f} MB".format(name, elapsed, size / 2 ** 20))
+    return result
+
+
+def build_tree(wikis, width):
+    tree = tr.Tree()
+    root = tree.add(tr.COMMUNITY, -1, "https://connections.example.com/communities/root", "Root")
+    for i in range(wikis):
+        tree.add(tr.WIKI, root if i < width else (i - width) // width + 1, URL.format(i // 1000, i), "Page {}".format(i))
+    return tree
+
+
+def build_nested(wikis, width, root_path):
+    # The layout before the compact tree, every wiki kept its three paths
+    root = {"name": "Root", "url": "https://connections.example.com/communities/root", "wikis": [], "subcomm": []}
+    nodes = []
+    for i in range(wikis):
+        url = URL.format(i // 1000, i)
+        parent = root if i < width else nodes[(i - width) // width]
+        wiki_path = os.path.join(parent.get("wiki_path", root_path), paths.url_name(url))
+        wiki = {
+            "url": url, "name": "Page {}".format(i), "subwiki": [], "wiki_path": wiki_path,
+            "links_path": os.path.join(wiki_path, paths.LINKS_DIR),
+            "attachments_path": os.path.join(wiki_path, paths.ATTACHMENTS_DIR),
+        }
+        (root["wikis"] if parent is root else parent["subwiki"]).append(wiki)
+        nodes.append(wiki)
+    return root
+
+
+def main():
+    args = docopt(__doc__)
+    wikis = int(args['--wikis'] or 200000)
+    width = int(args['--width'] or 10)
+
+    path = tempfile.mkdtemp(prefix="w3cpull-bench-")
+    try:
+        print("{} wikis, {} child pages per page".format(wikis, width))
+        tree = measure("tree", lambda: build_tree(wikis, width))
+        measure("tree paths", lambda: paths.PathIndex().build(path, tree, False))
+        cache_path = os.path.join(path, "tree.jsonl")
+        measure("tree cache dump", lambda: tree.dump(cache_path))
+        del tree
+        measure("tree cache load", lambda: tr.Tree.load(cache_path))
+        measure("nested with paths", lambda: build_nested(wikis, width, path))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+'''
+Local stand-in for w3 Connections
+
+Generates a synthetic community with subcommunities, a wiki tree of the
+given depth and width, and links and attachments of the given size, and
+serves it with the element ids and URL layout the downloader relies on.
+
+Usage:
+    mock_connections.py [--port=PORT] [--depth=N] [--width=N] [--links=N] [--attachments=N] [--size=BYTES] [--subcommunities=N]
+    mock_connections.py -h | --help
+
+Options:
+    --port=PORT             Set the port to listen on (by default, any free port)
+    --depth=N               Set the depth of the wiki tree (by default, 2)
+    --width=N               Set the number of child pages of every wiki page (by default, 3)
+    --links=N               Set the number of linked files on every page (by default, 4)
+    --attachments=N         Set the number of attachments of every page (by default, 4)
+    --size=BYTES            Set the size of every file in bytes (by default, 65536)
+    --subcommunities=N      Set the number of subcommunities of the root community (by default, 0)
+    -h, --help              Show this help message.
+'''
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from w3cpull import tree as tr
+from docopt import docopt
+import urllib.parse
+import threading
+import html
+import json
+import os
+import re
+
+COMMUNITY_PATH = "/communities/service/html/communityoverview"
+WIKI_PAGE_PATH = "/wikis/home/wiki/{wiki}/page/{page}"
+EXPORT_PATH = "/wikis/basic/api/wiki/{wiki}/page/{page}/media"
+FILE_PATH = "/wikis/basic/api/wiki/{wiki}/page/{page}/attachment/{name}"
+FEED_PATH = "/wikis/basic/api/wiki/{wiki}/page/{page}/feed"
+ATTACHMENTS_PER_PAGE = 10
+
+COMMUNITY_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Overview - {name}</title></head>
+<body>
+<a id="dropdownNavMenuTitleLink" href="#">Navigation</a>
+<ul id="lotusNavBar">
+<li widgetdefid="Overview"><a href="{url}">Overview</a></li>
+<li widgetdefid="Wiki"><a href="{wiki_url}">Wiki</a></li>
+</ul>
+<div id="dropdownSubMenuContainer" class="{submenu_class}">
+<div id="dropdownSubMenu"><div><div><div><ul>
+{subcommunities}
+</ul></div></div></div></div>
+</div>
+</body>
+</html>
+"""
+
+WIKI_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Wiki - {title}</title></head>
+<body>
+<div id="lconnWikisNavTree"><div>Navigation</div><div><div>Pages</div><div>
+{tree}
+</div></div></div>
+<a href="#">Page Actions</a>
+<table><tbody><tr><td onclick="window.location.href = '{export_url}'">Download Page</td></tr></tbody></table>
+<div id="wikiContentDiv">
+{content}
+</div>
+<a id="attachments_link" href="#">Attachments</a>
+<div id="attachments">
+<div id="wikiPageAttachments">
+<div><ul><li>First</li><li>Previous</li><li>Pages</li><li id="attachmentsNext"></li></ul></div>
+<table><tbody id="attachmentsRows"></tbody></table>
+</div>
+</div>
+<script>
+var attachments = {attachments};
+var attachmentsPage = 0;
+function showAttachments() {{
+    var start = attachmentsPage * {per_page};
+    var rows = attachments.slice(start, start + {per_page}).map(function (item) {{
+        return "<tr><td><a href=\\"" + item.url + "\\">" + item.name + "</a></td></tr>";
+    }});
+    if (rows.length === 0) {{
+        rows = ["<tr><td class=\\"lotusEmpty\\">There are no attachments for this page.</td></tr>"];
+    }}
+    document.getElementById("attachmentsRows").innerHTML = rows.join("");
+    var next = document.getElementById("attachmentsNext");
+    next.innerHTML = start + {per_page} < attachments.length ? "<a href=\\"#\\" onclick=\\"attachmentsPage++; showAttachments(); return false;\\">Next</a>" : "";
+}}
+showAttachments();
+</script>
+</body>
+</html>
+"""
+
+TREE_ROW_TEMPLATE = """<div><div><img alt=""/><img alt="" onclick="return false;"/><span></span><span><a href="{url}" title="{title}">{title}</a></span></div><div>{children}</div></div>"""
+
+FEED_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">
+<title>{title}</title>
+<opensearch:totalResults>{total}</opensearch:totalResults>
+<opensearch:itemsPerPage>{size}</opensearch:itemsPerPage>
+{entries}
+</feed>
+"""
+
+FEED_ENTRY_TEMPLATE = """<entry><title>{name}</title><link rel="enclosure" href="{url}" length="{length}"/></entry>"""
+
+EXPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>{title}</title></head>
+<body>
+{content}
+</body>
+</html>
+"""
+
+
+def community_name(path):
+    return "Community {}".format(path) if path else "Community"
+
+
+def generate(depth=2, width=3, links=4, attachments=4, size=65536, subcommunities=0):
+    # Every community has its own wiki, pages are numbered by their position in the tree
+    model = {"communities": {}, "pages": {}, "files": {}, "size": size}
+
+    def add_pages(wiki, parent, level):
+        pages = []
+        for i in range(width):
+            page = "{}-{}".format(parent, i + 1) if parent else "Page-{}".format(i + 1)
+            item = {
+                "wiki": wiki,
+                "page": page,
+                "title": page.replace("-", " "),
+                "links": ["link-{}-{}.bin".format(page, j + 1) for j in range(links)],
+                "attachments": ["attachment-{}-{}.bin".format(page, j + 1) for j in range(attachments)],
+                "children": add_pages(wiki, page, level + 1) if level < depth else [],
+            }
+            model["pages"][(wiki, page)] = item
+            for name in item["links"] + item["attachments"]:
+                model["files"][(wiki, page, name)] = size
+            pages.append(page)
+        return pages
+
+    def add_community(uuid, name, children):
+        wiki = "wiki-{}".format(uuid)
+        model["communities"][uuid] = {
+            "uuid": uuid,
+            "name": name,
+            "wiki": wiki,
+            "pages": add_pages(wiki, "", 1) if depth > 0 else [],
+            "subcommunities": children,
+        }
+
+    children = ["sub-{}".format(i + 1) for i in range(subcommunities)]
+    add_community("root", community_name(""), children)
+    for i, uuid in enumerate(children):
+        add_community(uuid, community_name(i + 1), [])
+    return model
+
+
+class ConnectionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, Nagle would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+    model = None
+    payload = b""
+    lock = threading.Lock()
+    stats = {"requests": 0, "bytes": 0}
+
+    def base_url(self):
+        return "http://{}".format(self.headers.get("Host"))
+
+    def community_url(self, uuid):
+        return "{}{}?communityUuid={}".format(self.base_url(), COMMUNITY_PATH, uuid)
+
+    def page_url(self, wiki, page):
+        return self.base_url() + WIKI_PAGE_PATH.format(wiki=wiki, page=page)
+
+    def file_url(self, wiki, page, name):
+        return self.base_url() + FILE_PATH.format(wiki=wiki, page=page, name=name)
+
+    def content(self, item):
+        links = "\n".join(
+            '<p><a href="{}">{}</a></p>'.format(html.escape(self.file_url(item["wiki"], item["page"], name)), name)
+            for name in item["links"]
+        )
+        return "<h1>{}</h1>\n{}".format(html.escape(item["title"]), links)
+
+    def tree(self, wiki, pages):
+        return "".join(
+            TREE_ROW_TEMPLATE.format(
+                url=html.escape(self.page_url(wiki, page)),
+                title=html.escape(self.model["pages"][(wiki, page)]["title"]),
+                children=self.tree(wiki, self.model["pages"][(wiki, page)]["children"]),
+            )
+            for page in pages
+        )
+
+    def community_page(self, community):
+        wiki_url = self.page_url(community["wiki"], community["pages"][0]) if community["pages"] else "#"
+        subcommunities = "\n".join(
+            '<li><a href="{}">{}</a></li>'.format(
+                html.escape(self.community_url(uuid)), html.escape(self.model["communities"][uuid]["name"])
+            )
+            for uuid in community["subcommunities"]
+        )
+        return COMMUNITY_TEMPLATE.format(
+            name=html.escape(community["name"]),
+            url=html.escape(self.community_url(community["uuid"])),
+            wiki_url=html.escape(wiki_url),
+            submenu_class="" if community["subcommunities"] else "lotusHidden",
+            subcommunities=subcommunities,
+        )
+
+    def wiki_page(self, item):
+        community = [c for c in self.model["communities"].values() if c["wiki"] == item["wiki"]][0]
+        attachments = [
+            {"name": name, "url": self.file_url(item["wiki"], item["page"], name)} for name in item["attachments"]
+        ]
+        return WIKI_TEMPLATE.format(
+            title=html.escape(item["title"]),
+            tree=self.tree(item["wiki"], community["pages"]),
+            export_url=self.base_url() + EXPORT_PATH.format(wiki=item["wiki"], page=item["page"]),
+            content=self.content(item),
+            attachments=json.dumps(attachments).replace("</", "<\\/"),
+            per_page=ATTACHMENTS_PER_PAGE,
+        )
+
+    def feed(self, item, query):
+        size = int(query.get("ps", ["10"])[0])
+        index = int(query.get("page", ["1"])[0])
+        names = item["attachments"][(index - 1) * size:index * size]
+        entries = "\n".join(
+            FEED_ENTRY_TEMPLATE.format(
+                name=html.escape(name), url=html.escape(self.file_url(item["wiki"], item["page"], name)),
+                length=self.model["size"]
+            )
+            for name in names
+        )
+        return FEED_TEMPLATE.format(
+            title=html.escape(item["title"]), total=len(item["attachments"]), size=size, entries=entries
+        )
+
+    def route(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        if parsed.path == COMMUNITY_PATH:
+            community = self.model["communities"].get(query.get("communityUuid", [""])[0])
+            if community is not None:
+                return 200, "text/html; charset=utf-8", self.community_page(community).encode("utf-8"), {}
+        match = re.match(r"^/wikis/home/wiki/([^/]+)/page/([^/]+)$", parsed.path)
+        if match and match.groups() in self.model["pages"]:
+            item = self.model["pages"][match.groups()]
+            return 200, "text/html; charset=utf-8", self.wiki_page(item).encode("utf-8"), {}
+        match = re.match(r"^/wikis/basic/api/wiki/([^/]+)/page/([^/]+)/media$", parsed.path)
+        if match and match.groups() in self.model["pages"]:
+            item = self.model["pages"][match.groups()]
+            body = EXPORT_TEMPLATE.format(title=html.escape(item["title"]), content=self.content(item)).encode("utf-8")
+            disposition = 'attachment; filename="{}.html"'.format(item["title"])
+            return 200, "text/html; charset=utf-8", body, {"Content-Disposition": disposition}
+        match = re.match(r"^/wikis/basic/api/wiki/([^/]+)/page/([^/]+)/feed$", parsed.path)
+        if match and match.groups() in self.model["pages"] and query.get("category") == ["attachment"]:
+            return 200, "application/atom+xml", self.feed(self.model["pages"][match.groups()], query).encode("utf-8"), {}
+        match = re.match(r"^/wikis/basic/api/wiki/([^/]+)/page/([^/]+)/attachment/([^/]+)$", parsed.path)
+        if match and match.groups() in self.model["files"]:
+            # Every file starts with its own name, so the content of two files is never the same
+            name = match.group(3).encode("utf-8")
+            body = (name + self.payload)[:self.model["files"][match.groups()]]
+            return 200, "application/octet-stream", body, {"ETag": '"{}"'.format(len(body))}
+        return 404, "text/plain", b"Not found", {}
+
+    def respond(self, send_body):
+        status, content_type, body, headers = self.route()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body) if send_body else 0
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockConnections:
+    def __init__(self, model, port=0):
+        handler = type("Handler", (ConnectionsHandler,), {
+            "model": model,
+            "payload": os.urandom(model["size"]),
+            "lock": threading.Lock(),
+            "stats": {"requests": 0, "bytes": 0},
+        })
+        self.model = model
+        self.handler = handler
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def stats(self):
+        with self.handler.lock:
+            return dict(self.handler.stats)
+
+    def community_url(self, uuid="root"):
+        return "{}{}?communityUuid={}".format(self.base_url, COMMUNITY_PATH, uuid)
+
+    def page_url(self, wiki, page):
+        return self.base_url + WIKI_PAGE_PATH.format(wiki=wiki, page=page)
+
+    def file_url(self, wiki, page, name):
+        return self.base_url + FILE_PATH.format(wiki=wiki, page=page, name=name)
+
+    def communities_tree(self, uuid="root"):
+        # The tree that downloader.create_communities_tree returns
+        return tr.Tree.from_nested(self.nested_tree(uuid))
+
+    def nested_tree(self, uuid="root"):
+        community = self.model["communities"][uuid]
+
+        def wikis(pages):
+            return [
+                {
+                    "url": self.page_url(community["wiki"], page),
+                    "name": self.model["pages"][(community["wiki"], page)]["title"],
+                    "subwiki": wikis(self.model["pages"][(community["wiki"], page)]["children"]),
+                }
+                for page in pages
+            ]
+
+        return {
+            "name": community["name"],
+            "url": self.community_url(uuid),
+            "wikis": wikis(community["pages"]),
+            "subcomm": [self.nested_tree(child) for child in community["subcommunities"]],
+        }
+
+    def attachments(self, wiki_url):
+        wiki, page = re.search(r"/wiki/([^/]+)/page/([^/?#]+)", wiki_url).groups()
+        return [self.file_url(wiki, page, name) for name in self.model["pages"][(wiki, page)]["attachments"]]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    args = docopt(__doc__)
+    model = generate(
+        int(args['--depth'] or 2),
+        int(args['--width'] or 3),
+        int(args['--links'] or 4),
+        int(args['--attachments'] or 4),
+        int(args['--size'] or 65536),
+        int(args['--subcommunities'] or 0),
+    )
+    mock = MockConnections(model, int(args['--port'] or 0))
+    print("{} pages, {} files".format(len(model["pages"]), len(model["files"])))
+    print("Community: {}".format(mock.community_url()))
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.close()
+
+
+if __name__ == '__main__':
+    main()
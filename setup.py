@@ -21,7 +21,11 @@ setup(
         "schema == 0.7.2",
         "selenium == 3.141.0",
     ],
+    extras_require={
+        "async": ["aiohttp >= 3.6"],
+        "zstd": ["zstandard >= 0.15"],
+    },
     include_package_data=True,
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     scripts=['bin/w3cpull'],
 )
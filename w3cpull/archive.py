@@ -0,0 +1,113 @@
+import logging as log
+import threading
+import tarfile
+import zipfile
+import queue
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PART_SUFFIX = ".part"
+TAR_MODES = {
+    ".tar": "w|",
+    ".tar.gz": "w|gz",
+    ".tgz": "w|gz",
+    ".tar.bz2": "w|bz2",
+    ".tar.xz": "w|xz",
+}
+ZSTD_SUFFIXES = (".tar.zst", ".tzst")
+ZIP_SUFFIXES = (".zip",)
+ZSTD_LEVEL = 3
+
+
+def supported(path):
+    return path.endswith(tuple(TAR_MODES) + ZSTD_SUFFIXES + ZIP_SUFFIXES)
+
+
+class Archive:
+    # Files are packed by one thread as soon as they are complete and removed from the disk
+    def __init__(self, path, root):
+        self.path = os.path.abspath(path)
+        self.root = os.path.abspath(root)
+        self.part = self.path + PART_SUFFIX
+        self.names = set()
+        self.links = {}
+        self.raw = None
+        self.stream = None
+        self.tar = None
+        self.zip = None
+        if self.path.endswith(ZIP_SUFFIXES):
+            self.zip = zipfile.ZipFile(self.part, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        elif self.path.endswith(ZSTD_SUFFIXES):
+            if zstandard is None:
+                raise RuntimeError("The tar.zst output requires zstandard (pip install w3cpull[zstd])")
+            self.raw = open(self.part, "wb")
+            self.stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self.raw)
+            self.tar = tarfile.open(fileobj=self.stream, mode="w|")
+        else:
+            mode = [mode for suffix, mode in TAR_MODES.items() if self.path.endswith(suffix)][0]
+            self.tar = tarfile.open(self.part, mode=mode)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, name="archive", daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while True:
+            file = self.queue.get()
+            try:
+                if file is None:
+                    return
+                self.add(file)
+            except Exception as e:
+                # The thread has to go on, or close() would wait for its queue forever
+                log.warning("Failed to archive {}: {}".format(file, e))
+            finally:
+                self.queue.task_done()
+
+    def add(self, file):
+        name = os.path.relpath(file, self.root)
+        if name in self.names:
+            # The same link on one page is fetched twice, the first copy is already packed
+            if os.path.exists(file):
+                os.remove(file)
+            return
+        self.names.add(name)
+        stat = os.stat(file)
+        # Deduplicated files are hardlinks to one blob, the blob keeps the inode alive for the whole run
+        key = (stat.st_dev, stat.st_ino) if stat.st_nlink > 1 else None
+        if self.zip is not None:
+            self.zip.write(file, name)
+        elif key in self.links:
+            info = self.tar.gettarinfo(file, name)
+            info.type = tarfile.LNKTYPE
+            info.linkname = self.links[key]
+            info.size = 0
+            self.tar.addfile(info)
+        else:
+            self.tar.add(file, name, recursive=False)
+            if key is not None:
+                self.links[key] = name
+        os.remove(file)
+
+    def submit(self, file):
+        self.queue.put(os.path.abspath(file))
+
+    def join(self):
+        self.queue.join()
+
+    def close(self, ok=True):
+        # An unfinished archive is left next to the target with the .part suffix
+        self.queue.put(None)
+        self.thread.join()
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+            if self.stream is not None:
+                self.stream.close()
+                self.raw.close()
+        if ok:
+            os.replace(self.part, self.path)
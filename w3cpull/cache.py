@@ -0,0 +1,66 @@
+from w3cpull import tree as tr
+import urllib.parse
+import hashlib
+import json
+import time
+import os
+
+DEFAULT_TREE_TTL = 24 * 60 * 60
+DEFAULT_SESSION_TTL = 8 * 60 * 60
+
+
+def cache_dir():
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(root, "w3cpull")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def tree_path(community_url, recursive):
+    key = hashlib.md5("{}|{}".format(community_url, bool(recursive)).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), "tree-{}.jsonl".format(key))
+
+
+def load_tree(community_url, recursive, ttl=DEFAULT_TREE_TTL):
+    path = tree_path(community_url, recursive)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        return tr.Tree.load(path)
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_tree(community_url, recursive, tree):
+    tree.dump(tree_path(community_url, recursive))
+
+
+def session_path(community_url):
+    key = hashlib.md5(urllib.parse.urlsplit(community_url).netloc.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), "session-{}.json".format(key))
+
+
+def load_session(community_url, ttl=DEFAULT_SESSION_TTL):
+    # Returns the cookies of the last login on this host unless they are too old or expired
+    path = session_path(community_url)
+    try:
+        with open(path, "r") as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    if now - session.get("saved", 0) > ttl:
+        return None
+    cookies = [cookie for cookie in session.get("cookies", []) if cookie.get("expiry", now + 1) > now]
+    return cookies if len(cookies) > 0 else None
+
+
+def save_session(community_url, cookies):
+    # The cookies are as good as a password, only the owner may read them
+    path = session_path(community_url)
+    temp = "{}.tmp".format(path)
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"saved": time.time(), "cookies": cookies}, f)
+    os.replace(temp, path)
+
@@ -2,7 +2,7 @@ from selenium.common.exceptions import (
     TimeoutException,
     ElementNotInteractableException,
     ElementClickInterceptedException,
-    NoSuchElementException,
+    WebDriverException,
 )
 from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 from selenium.webdriver.support import expected_conditions as EC
@@ -14,22 +14,170 @@ from datetime import (
     datetime,
     timezone
 )
+from w3cpull import manifest as mf
+from w3cpull import modifier as mod
+from w3cpull import paths
+from w3cpull import ratelimit
+from w3cpull import transfer
+from w3cpull import tree as tr
+from w3cpull import watcher
+from xml.etree import ElementTree
 from selenium import webdriver
 import logging as log
 import urllib.parse
+import concurrent.futures
+import contextlib
+import functools
 import platform
 import threading
+import html
 import requests
 import hashlib
 import shutil
-import glob
+import queue
 import time
+import re
 import sys
 import os
 
-DOWNLOAD_THREADS = []
-
-def init(module_dir, selenium_target_dir, selenium_temp_download_dir, visual, browser):
+PAGE_EXPORT_URL = "{scheme}://{host}/wikis/basic/api/wiki/{wiki}/page/{page}/media"
+ATTACHMENTS_FEED_URL = "{scheme}://{host}/wikis/basic/api/wiki/{wiki}/page/{page}/feed?category=attachment&ps={size}&page={index}"
+ATTACHMENTS_PAGE_SIZE = 100
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom", "opensearch": "http://a9.com/-/spec/opensearch/1.1/"}
+SCRIPT_TIMEOUT = 120
+PLAN_WORKERS = 8
+
+# Expands every node of the wiki navigation tree (children may be loaded lazily)
+# and returns the whole tree in a single WebDriver call, as a preorder list with parent indices
+WIKI_TREE_SCRIPT = """
+var root = arguments[0];
+var done = arguments[arguments.length - 1];
+function first(node, xpath) {
+    return document.evaluate(xpath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function rows(node) {
+    return Array.prototype.filter.call(node.children, function (child) { return child.tagName === "DIV"; });
+}
+function expand(node) {
+    var clicked = 0;
+    rows(node).forEach(function (row) {
+        if (!row.hasAttribute("data-w3cpull-expanded")) {
+            row.setAttribute("data-w3cpull-expanded", "");
+            var toggle = first(row, "./div[1]/img[2]");
+            if (toggle) { toggle.click(); clicked++; }
+        }
+        var children = first(row, "./div[2]");
+        if (children) { clicked += expand(children); }
+    });
+    return clicked;
+}
+function serialize(node) {
+    var nodes = [];
+    var stack = rows(node).reverse().map(function (row) { return [row, -1]; });
+    while (stack.length > 0) {
+        var item = stack.pop();
+        var link = first(item[0], "./div[1]/span[2]/a");
+        var children = first(item[0], "./div[2]");
+        nodes.push({url: link ? link.href : null, name: link ? link.title : null, parent: item[1]});
+        if (children) {
+            var index = nodes.length - 1;
+            rows(children).reverse().forEach(function (row) { stack.push([row, index]); });
+        }
+    }
+    return nodes;
+}
+(function settle(previous, stable) {
+    var clicked = expand(root);
+    var count = root.getElementsByTagName("div").length;
+    stable = clicked === 0 && count === previous ? stable + 1 : 0;
+    if (stable >= 2) {
+        done(serialize(root));
+    } else {
+        setTimeout(function () { settle(count, stable); }, 250);
+    }
+})(-1, 0);
+"""
+
+# Follows the attachments pager inside the browser and returns every attachment URL
+ATTACHMENTS_SCRIPT = """
+var root = arguments[0];
+var done = arguments[arguments.length - 1];
+var urls = [];
+function first(node, xpath) {
+    return document.evaluate(xpath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function rows() {
+    return Array.prototype.map.call(root.querySelectorAll("tbody tr"), function (row) {
+        var link = row.querySelector("a");
+        return link ? link.href : null;
+    });
+}
+function collect(previous, waited) {
+    var current = rows();
+    var key = current.join("\\n");
+    if (key === previous) {
+        // The next page has not been rendered yet
+        if (waited >= 40) { done(urls); } else { setTimeout(function () { collect(previous, waited + 1); }, 250); }
+        return;
+    }
+    current.forEach(function (url) { if (url && urls.indexOf(url) < 0) { urls.push(url); } });
+    var next = first(document, '//*[@id="wikiPageAttachments"]/div[1]/ul[1]/li[4]');
+    var link = next && next.childElementCount > 0 ? first(next, "./a") : null;
+    if (!link) {
+        done(urls);
+        return;
+    }
+    link.click();
+    setTimeout(function () { collect(key, 0); }, 250);
+}
+(function start(waited) {
+    // The list may be loaded after the attachments are opened, so the first page waits for rows or the empty list
+    var loaded = root.querySelector("tbody tr") !== null || root.querySelector(".lotusEmpty") !== null;
+    if (loaded || waited >= 40) { collect(null, 0); } else { setTimeout(function () { start(waited + 1); }, 250); }
+})(0);
+"""
+
+# Evaluates every XPath query against the document (or the given root) and returns the
+# requested attributes of the matched nodes, so a page is read in a single WebDriver call
+EXTRACT_SCRIPT = """
+var queries = arguments[0];
+var root = arguments[1] || document;
+var result = {};
+function value(node, name) {
+    if (name === "text") { return node.textContent; }
+    // Properties first, like WebElement.get_attribute, so links come back absolute
+    var property = node[name];
+    if (property === undefined || property === null || typeof property === "object" || typeof property === "function") {
+        return node.getAttribute(name);
+    }
+    return String(property);
+}
+Object.keys(queries).forEach(function (key) {
+    var nodes = document.evaluate(queries[key][0], root, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    result[key] = [];
+    for (var i = 0; i < nodes.snapshotLength; i++) {
+        var node = nodes.snapshotItem(i);
+        var item = {};
+        queries[key][1].forEach(function (name) { item[name] = value(node, name); });
+        result[key].push(item);
+    }
+});
+return result;
+"""
+
+# Name: (XPath, attributes)
+NAV_QUERIES = {
+    "wiki": ('//*[@id="lotusNavBar"]//*[@widgetdefid="Wiki"]/a[1]', ["href"]),
+}
+PAGE_QUERIES = {
+    "links": ('//div[@id="wikiContentDiv"]//a[contains(@href, "/api/")]', ["href"]),
+}
+SUBCOMMUNITY_QUERIES = {
+    "menu": ('//*[@id="dropdownSubMenuContainer"]', ["class"]),
+    "subcomm": ('//*[@id="dropdownSubMenuContainer"]/div[@id="dropdownSubMenu"]//div/div/div/ul/li/a[1]', ["href"]),
+}
+
+def init(module_dir, selenium_target_dir, selenium_temp_download_dir, visual, browser, download_workers=transfer.DEFAULT_WORKERS, io_backend=transfer.DEFAULT_BACKEND, manifest=None, direct_export=False, download_timeout=watcher.DEFAULT_TIMEOUT, browsers=1, store=None, segments=transfer.DEFAULT_SEGMENTS, rate_limit=None, host_rate_limit=None, metrics=None, archive=None):
     if not os.path.exists(selenium_target_dir):
         os.mkdir(selenium_target_dir)
     if not os.path.exists(selenium_temp_download_dir):
@@ -47,7 +195,37 @@ def init(module_dir, selenium_target_dir, selenium_temp_download_dir, visual, br
         None: firefox_init
     }
     browser_init = browser_case[browser]
-    return browser_init(module_dir, selenium_temp_download_dir, visual)
+    limiter = ratelimit.RateLimiter(rate_limit, host_rate_limit, download_workers)
+    path_index = paths.PathIndex()
+    downloader = Downloader(
+        transfer.init(download_workers, io_backend, manifest, store, segments, limiter, metrics, archive, path_index),
+        mod.Rewriter(manifest, metrics, archive, path_index),
+        manifest, metrics, path_index, direct_export, download_timeout
+    )
+    downloader.browsers = init_browsers(browser_init, module_dir, selenium_temp_download_dir, visual, browsers - 1)
+    downloader.driver = browser_init(module_dir, selenium_temp_download_dir, visual)
+    return downloader
+
+
+def init_browsers(browser_init, module_dir, selenium_temp_download_dir, visual, count):
+    # Every extra browser gets its own download directory, so exports are never mixed up
+    browsers = [None] * count
+
+    def start(i):
+        download_dir = "{}_{}".format(selenium_temp_download_dir, i + 1)
+        if not os.path.exists(download_dir):
+            os.mkdir(download_dir)
+        driver = browser_init(module_dir, download_dir, visual)
+        driver.implicitly_wait(10)
+        browsers[i] = (driver, download_dir)
+
+    threads = [threading.Thread(target=start, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return [item for item in browsers if item is not None]
 
 
 def chrome_init(module_dir, selenium_temp_download_dir, visual):
@@ -68,18 +246,23 @@ def chrome_init(module_dir, selenium_temp_download_dir, visual):
     return webdriver.Chrome(executable_path = os.path.join(module_dir, sys_case[platform.system()]), chrome_options=profile)
 
 
+@functools.lru_cache(maxsize=None)
+def mime_types(module_dir):
+    with open(os.path.join(module_dir, "mime-types.txt"), "r") as mime:
+        return mime.read()
+
+
 def firefox_init(module_dir, selenium_temp_download_dir, visual):
     profile = webdriver.FirefoxProfile()
+    # Scripts and styles are shared by every page, so they are cached in memory for the session
     profile.set_preference("browser.cache.disk.enable", False)
-    profile.set_preference("browser.cache.memory.enable", False)
+    profile.set_preference("browser.cache.memory.enable", True)
     profile.set_preference("browser.cache.offline.enable", False)
-    profile.set_preference("network.http.use-cache", False)
+    profile.set_preference("network.http.use-cache", True)
     profile.set_preference("browser.download.folderList", 2)
     profile.set_preference("browser.download.manager.showWhenStarting", False)
     profile.set_preference("browser.download.dir", selenium_temp_download_dir)
-    with open(os.path.join(module_dir, "mime-types.txt"), "r") as mime:
-        profile.set_preference("browser.helperApps.neverAsk.saveToDisk", mime.read())
-        mime.close()
+    profile.set_preference("browser.helperApps.neverAsk.saveToDisk", mime_types(module_dir))
 
     sys_case = {
         "Linux": "geckodriver_linux",
@@ -123,23 +306,61 @@ def w3id_auth(driver, w3id_login = None, w3id_password = None):
         clickw(driver, driver.find_element_by_id("btn_signin"))
 
 
-def create_download_thread(url, path):
-    r = requests.get(url, stream=True, allow_redirects=True)
-    with open(
-        os.path.join(
-            path, urllib.parse.unquote(url.rsplit("/", 1)[1].rsplit("?", 1)[0])
-        ), 'wb') as f:
-            for chunk in r.iter_content(1024):
-                if chunk:
-                    f.write(chunk)
+def add_cookies(driver, url, cookies):
+    # Cookies can only be added for the domain of the currently opened page. The pages of the host redirect
+    # to w3id without a session, a static file does not
+    parsed = urllib.parse.urlsplit(url)
+    driver.get("{}://{}/favicon.ico".format(parsed.scheme, parsed.netloc))
+    if not urllib.parse.urlsplit(driver.current_url).hostname == parsed.hostname:
+        log.warning("Failed to add the cookies, {} was redirected to {}".format(parsed.netloc, driver.current_url))
+        return False
+    for cookie in cookies:
+        if not parsed.hostname.endswith(cookie.get("domain", "").lstrip(".")):
+            continue
+        cookie = dict(cookie)
+        cookie.pop("sameSite", None)
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException as e:
+            log.warning("Failed to add the {} cookie: {}".format(cookie["name"], e))
+    return True
+
+
+def copy_session(src, dst):
+    add_cookies(dst, src.current_url, src.get_cookies())
 
 
-def download_file(url, path):
-    global DOWNLOAD_THREADS
+def run_in_pool(drivers, tasks, handler):
+    # The handler may return new tasks, they are queued for the whole pool
+    work = queue.Queue()
+    errors = []
+    for task in tasks:
+        work.put(task)
 
-    download_thread = threading.Thread(target=create_download_thread, args=(url, path))
-    DOWNLOAD_THREADS.append(download_thread)
-    download_thread.start()
+    def worker(driver):
+        while True:
+            task = work.get()
+            try:
+                if task is None:
+                    return
+                for child in handler(driver, task) or []:
+                    work.put(child)
+            except Exception as e:
+                log.error(e)
+                errors.append(e)
+            finally:
+                work.task_done()
+
+    threads = [threading.Thread(target=worker, args=(driver,), daemon=True) for driver in drivers]
+    for t in threads:
+        t.start()
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    if len(errors) > 0:
+        raise errors[0]
 
 
 def wait_community_page_load(driver):
@@ -157,140 +378,62 @@ def clickw(driver, el):
         driver.execute_script("arguments[0].click();", el)
 
 
-def get_wiki_tree(driver, wikis_menu_html):
-    full_tree = []
-    for child in wikis_menu_html.find_elements_by_xpath("./div"):
-        wiki_tree = {}
-        el = child.find_element_by_xpath("./div[1]/span[2]/a")
-        wiki_tree["url"] = el.get_attribute("href")
-        wiki_tree["name"] = el.get_attribute("title")
-        wiki_tree["subwiki"] = []
-        el = child.find_element_by_xpath("./div[1]/img[2]")
-        driver.execute_script("arguments[0].click();", el)
-        el = child.find_element_by_xpath("./div[2]")
-        if not str(el.get_attribute("childElementCount")) == "0":
-            for item in get_wiki_tree(driver, el):
-                wiki_tree["subwiki"].append(item)
-        full_tree.append(wiki_tree)
-
-    return full_tree
+def extract(driver, queries, root=None):
+    # Missing nodes give empty lists instead of waiting out the implicit wait
+    return driver.execute_script(EXTRACT_SCRIPT, queries, root)
 
 
-def create_fs_tree(root_path, communities_tree):
-    root_path = os.path.join(root_path, communities_tree["name"])
-    try:
-        os.mkdir(root_path)
-    except FileNotFoundError:
-        os.mkdir(root_path)
-
-    communities_tree["comm_path"] = root_path
-
-    def deep_dive(root, tree):
-        for item in tree:
-            wiki_path = os.path.join(
-                root,
-                urllib.parse.unquote(item["url"].rsplit("?", 1)[0].rsplit("/", 1)[1]),
-            )
-            os.mkdir(wiki_path)
-            item["wiki_path"] = wiki_path
+def get_wiki_tree(driver, wikis_menu_html, tree, parent):
+    # Rows without a link are skipped together with everything under them
+    driver.set_script_timeout(SCRIPT_TIMEOUT)
+    added = []
+    for row in driver.execute_async_script(WIKI_TREE_SCRIPT, wikis_menu_html):
+        under = parent if row["parent"] < 0 else added[row["parent"]]
+        added.append(None if row["url"] == None or under == None else tree.add(tr.WIKI, under, row["url"], row["name"]))
+    return tree
 
-            links_path = os.path.join(wiki_path, "links")
-            os.mkdir(links_path)
-            item["links_path"] = links_path
 
-            attachments_path = os.path.join(wiki_path, "attachments")
-            os.mkdir(attachments_path)
-            item["attachments_path"] = attachments_path
-
-            if len(item["subwiki"]) > 0:
-                deep_dive(wiki_path, item["subwiki"])
-
-    deep_dive(root_path, communities_tree["wikis"])
-    if len(communities_tree["subcomm"]) > 0:
-        for item in communities_tree["subcomm"]:
-            item = create_fs_tree(communities_tree["comm_path"], item)
-
-    return communities_tree
-
-
-def move_content(src, dst):
-    moved = []
-    while True:
-        files = glob.glob('{}/*'.format(os.path.abspath(src)))
-        if len(files) == 0:
-            time.sleep(1)
-            continue
-
-        done = True
-        for file in files:
-            if file.endswith('.crdownload'):
-                done = False
-                break
-        if done:
-            break
-        else:
-            time.sleep(1)
-            continue
+def page_export_url(wiki_url):
+    match = re.search(r"/wiki/([^/?#]+)/page/([^/?#]+)", wiki_url)
+    if match is None:
+        return None
+    parsed = urllib.parse.urlsplit(wiki_url)
+    return PAGE_EXPORT_URL.format(
+        scheme=parsed.scheme, host=parsed.netloc, wiki=match.group(1), page=match.group(2)
+    )
 
-    for item in glob.glob('{}/*'.format(os.path.abspath(src))):
-        moved.append(shutil.move(item, os.path.abspath(dst)))
 
-    return moved
+def get_wiki_attachments(driver, el):
+    driver.set_script_timeout(SCRIPT_TIMEOUT)
+    return driver.execute_async_script(ATTACHMENTS_SCRIPT, el)
 
 
-def download_to_dir(url, path):
-    r = requests.get(url, allow_redirects=True)
-    open(
-        os.path.join(
-            path, urllib.parse.unquote(url.rsplit("/", 1)[1].rsplit("?", 1)[0])
-        ),
-        "wb",
-    ).write(r.content)
+def parse_attachments_feed(content):
+    feed = ElementTree.fromstring(content)
+    total = feed.findtext("opensearch:totalResults", None, ATOM_NS)
+    urls = []
+    sizes = {}
+    for entry in feed.findall("atom:entry", ATOM_NS):
+        link = entry.find("atom:link[@rel='enclosure']", ATOM_NS)
+        url = link.get("href") if link is not None else entry.find("atom:content", ATOM_NS).get("src")
+        if transfer.file_name(url) == "media":
+            # The local name is taken from the last segment of the URL
+            url = "{}/{}".format(url, urllib.parse.quote(entry.findtext("atom:title", "", ATOM_NS)))
+        urls.append(url)
+        length = link.get("length") if link is not None else None
+        sizes[url] = int(length) if not length == None and length.isdigit() else None
+    return int(total) if not total == None else len(urls), urls, sizes
 
 
-def download_wiki(driver, wiki_name, wiki_path, wiki_links_path, wiki_attachments_path, selenium_temp_download_dir):
-    # Download Wiki
-    clickw(
-        driver, driver.find_element_by_xpath('//a[contains(text(), "Page Actions")]')
-    )
-    clickw(
-        driver, driver.find_element_by_xpath('//td[contains(text(), "Download Page")]')
-    )
-    move_content(selenium_temp_download_dir, wiki_path)
-    log.info('--- {} done'.format(wiki_name))
-    # Download Wiki links
-    el = driver.find_element_by_xpath('//div[@id="wikiContentDiv"]')
-    download_wiki_links(el, wiki_links_path)
-    log.info('------ {} (links) done'.format(wiki_name))
-    # Download Wiki Attachments
-    clickw(driver, driver.find_element_by_xpath('//*[@id="attachments_link"]'))
-    el = driver.find_element_by_xpath('//div[@id="attachments"]')
-    download_wiki_attachments(el, wiki_attachments_path)
-    log.info('------ {} (attachments) done'.format(wiki_name))
-
-
-def download_wiki_links(el, path):
-    try:
-        for child in el.find_elements_by_xpath('.//a[contains(@href, "/api/")]'):
-            download_file(child.get_attribute("href"), path)
-    except NoSuchElementException:
-        return None
-
-
-def download_wiki_attachments(el, path):
-    try:
-        for child in el.find_elements_by_xpath(".//tbody/tr"):
-            download_file(
-                child.find_element_by_xpath(".//a").get_attribute("href"), path
-            )
-        next = el.find_element_by_xpath(
-            '//*[@id="wikiPageAttachments"]/div[1]/ul[1]/li[4]'
-        )
-        if not str(next.get_attribute("childElementCount")) == "0":
-            next.find_element_by_xpath("./a").click()
-            download_wiki_attachments(el, path)
-    except NoSuchElementException:
+def attachments_feed_url(wiki_url, index):
+    match = re.search(r"/wiki/([^/?#]+)/page/([^/?#]+)", wiki_url)
+    if match is None:
         return None
+    parsed = urllib.parse.urlsplit(wiki_url)
+    return ATTACHMENTS_FEED_URL.format(
+        scheme=parsed.scheme, host=parsed.netloc, wiki=match.group(1), page=match.group(2),
+        size=ATTACHMENTS_PAGE_SIZE, index=index
+    )
 
 
 def open_wiki_section(driver):
@@ -298,81 +441,299 @@ def open_wiki_section(driver):
         EC.element_to_be_clickable((By.ID, "dropdownNavMenuTitleLink"))
     )
     clickw(driver, el)
-    el = driver.find_element_by_id("lotusNavBar")
-    for child in el.find_elements_by_xpath(".//*"):
-        if child.get_attribute("widgetdefid") == "Wiki":
-            driver.get(child.find_element_by_xpath("./a").get_attribute("href"))
-            wait_wiki_page_load(driver)
-            break
+    # The menu is rendered after the click, an empty read would skip the wiki without an error
+    ui.WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, "lotusNavBar")))
+    links = extract(driver, NAV_QUERIES)["wiki"]
+    if len(links) > 0:
+        driver.get(links[0]["href"])
+        wait_wiki_page_load(driver)
 
 
-def download_community(driver, tree, selenium_temp_download_dir):
-    global DOWNLOAD_THREADS
-
-    def deep_dive(wikis):
-        for wiki in wikis:
-            driver.get(wiki["url"])
-            wait_wiki_page_load(driver)
-            download_wiki(
-                driver,
-                wiki["name"],
-                wiki["wiki_path"],
-                wiki["links_path"],
-                wiki["attachments_path"],
-                selenium_temp_download_dir
-            )
-            if len(wiki["subwiki"]) > 0:
-                deep_dive(wiki["subwiki"])
-    deep_dive(tree["wikis"])
-    if len(tree["subcomm"]) > 0:
-        for subcomm in tree["subcomm"]:
-            download_community(driver, subcomm, selenium_temp_download_dir)
-
-    for t in DOWNLOAD_THREADS:
-        t.join()
+def flatten_wikis(tree):
+    return (tree.wiki(index) for index in tree.wikis())
 
 
-def create_communities_tree(driver, community_url, recursive, w3id_login = None, w3id_password = None):
-    communities_tree = {}
+def login(driver, community_url, w3id_login = None, w3id_password = None):
     driver.get(community_url)
 
     if driver.title == "IBM w3id":
         w3id_auth(driver, w3id_login, w3id_password)
     wait_community_page_load(driver)
 
-    communities_tree["name"] = driver.title[11:]
-    communities_tree["url"] = community_url
 
-    communities_tree["wikis"] = []
+def scan_community(driver, tree, index, community_url, recursive, w3id_login = None, w3id_password = None):
+    # Fills the community node and its wikis, returns the links of the subcommunities
+    login(driver, community_url, w3id_login, w3id_password)
+
+    tree.rename(index, driver.title[11:])
+
     open_wiki_section(driver)
     wikis_menu_html = driver.find_element_by_xpath(
         '//div[@id="lconnWikisNavTree"]/div[2]/div[2]'
     )
-    wikis_tree = get_wiki_tree(driver, wikis_menu_html)
-    communities_tree["wikis"] = wikis_tree
-    log.info("--- {} (wiki) done".format(communities_tree["name"]))
-
-    communities_tree["subcomm"] = []
+    get_wiki_tree(driver, wikis_menu_html, tree, index)
+    log.info("--- {} (wiki) done".format(tree.names[index]))
 
+    sub_links = []
     if recursive:
         driver.get(community_url)
         wait_community_page_load(driver)
-        el = driver.find_element_by_xpath('//*[@id="dropdownSubMenuContainer"]')
-        if not "lotusHidden" in el.get_attribute("class"):
-            sub_links = []
-            for child in el.find_elements_by_xpath(
-                './div[@id="dropdownSubMenu"]//div/div/div/ul/li'
-            ):
-                sub_links.append(child.find_element_by_xpath("./a").get_attribute("href"))
-            for sub_link in sub_links:
-                communities_tree["subcomm"].append(
-                    create_communities_tree(driver, sub_link, w3id_login, w3id_password)
-                )
-            log.info("--- {} (subcommunities)  done".format(communities_tree["name"]))
-        log.info("--- {}  done".format(communities_tree["name"]))
-
-    return communities_tree
-
-
-def finish(driver):
-    driver.close()
+        ui.WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, "dropdownSubMenuContainer")))
+        menu = extract(driver, SUBCOMMUNITY_QUERIES)
+        if len(menu["menu"]) > 0 and not "lotusHidden" in (menu["menu"][0]["class"] or ""):
+            sub_links = [link["href"] for link in menu["subcomm"]]
+
+    return sub_links
+
+
+class Downloader:
+    # The engines of one pull, every puller owns its own and nothing is shared through the module
+    def __init__(self, transfer_engine, rewriter, manifest=None, metrics=None, path_index=None, direct_export=False, download_timeout=watcher.DEFAULT_TIMEOUT):
+        self.transfer = transfer_engine
+        self.rewriter = rewriter
+        self.manifest = manifest
+        self.metrics = metrics
+        self.paths = path_index if path_index is not None else paths.PathIndex()
+        self.direct_export = direct_export
+        self.download_timeout = download_timeout
+        self.driver = None
+        self.browsers = []
+        self.watchers = {}
+        # The feeds of every community are planned on the same threads, each of them keeps a session
+        self.planner = concurrent.futures.ThreadPoolExecutor(max_workers=PLAN_WORKERS, thread_name_prefix="plan")
+        # Takes (urls, path) instead of the transfer pool, so a worker can hand attachments to other nodes
+        self.attachments_handler = None
+
+    def get_watcher(self, selenium_temp_download_dir):
+        if not selenium_temp_download_dir in self.watchers:
+            self.watchers[selenium_temp_download_dir] = watcher.DownloadWatcher(
+                selenium_temp_download_dir, self.download_timeout
+            )
+        return self.watchers[selenium_temp_download_dir]
+
+    def share_cookies(self, driver):
+        self.transfer.set_cookies(driver.get_cookies())
+
+    def download_file(self, url, path):
+        self.transfer.submit(url, path)
+
+    def create_fs_tree(self, root_path, tree, create=True):
+        return self.paths.build(root_path, tree, create)
+
+    def export_page(self, wiki_name, wiki_path, wiki_url):
+        url = page_export_url(wiki_url)
+        if url is None:
+            return None
+        try:
+            return self.transfer.fetch(url, wiki_path, "{}.html".format(wiki_name.replace("/", "_")), "page")
+        except transfer.ERRORS as e:
+            log.warning("Direct export of {} failed, falling back to the browser: {}".format(wiki_name, e))
+            return None
+
+    def download_wiki(self, driver, wiki_name, wiki_path, wiki_links_path, wiki_attachments_path, selenium_temp_download_dir, wiki_url=None, attachments=None, page=None):
+        # Download Wiki (the page may already be exported over HTTP)
+        direct = not page == None
+        if direct:
+            log.info('--- {} done'.format(wiki_name))
+        elif self.manifest is not None and self.manifest.synced(wiki_url):
+            log.info('--- {} skipped (already synced)'.format(wiki_name))
+        else:
+            page_watcher = self.get_watcher(selenium_temp_download_dir)
+            page_watcher.expect()
+            clickw(
+                driver, driver.find_element_by_xpath('//a[contains(text(), "Page Actions")]')
+            )
+            clickw(
+                driver, driver.find_element_by_xpath('//td[contains(text(), "Download Page")]')
+            )
+            start = time.time()
+            try:
+                page = page_watcher.collect(wiki_path, wiki_name)
+                if self.manifest is not None:
+                    self.manifest.record(wiki_url, page, "page", os.path.getsize(page), sha256=mf.file_sha256(page))
+                log.info('--- {} done'.format(wiki_name))
+            except TimeoutError as e:
+                log.warning('--- {} failed: {}'.format(wiki_name, e))
+                if self.metrics is not None:
+                    self.metrics.add(os.path.abspath(wiki_path), errors=1)
+            if self.metrics is not None:
+                self.metrics.add(os.path.abspath(wiki_path), move_wait_seconds=time.time() - start)
+        if self.metrics is not None:
+            self.metrics.add(os.path.abspath(wiki_path), pages=1)
+        # Download Wiki links
+        if direct:
+            self.download_page_links(page, wiki_url, wiki_links_path)
+        else:
+            self.download_wiki_links(extract(driver, PAGE_QUERIES)["links"], wiki_links_path)
+        if not page == None:
+            self.rewriter.submit(page)
+        log.info('------ {} (links) done'.format(wiki_name))
+        # Download Wiki Attachments (the list may be known from the work plan or the feed)
+        if attachments == None:
+            clickw(driver, driver.find_element_by_xpath('//*[@id="attachments_link"]'))
+            el = driver.find_element_by_xpath('//div[@id="attachments"]')
+            attachments = get_wiki_attachments(driver, el)
+        (self.attachments_handler or self.transfer.submit_all)(attachments, wiki_attachments_path)
+        log.info('------ {} (attachments) done'.format(wiki_name))
+
+    def download_page_links(self, page, base_url, path):
+        with open(page, "r", errors="replace") as f:
+            content = f.read()
+        links = []
+        for link in re.findall(r"href=\"([^\"]*/api/[^\"]*)\"", content):
+            link = urllib.parse.urljoin(base_url, html.unescape(link))
+            if not link in links:
+                links.append(link)
+        if self.manifest is not None:
+            # A page that was not modified keeps its rewritten copy, which only links to the local files
+            links.extend(link for link in self.manifest.urls(path) if not link in links)
+        for link in links:
+            self.download_file(link, path)
+
+    def download_wiki_links(self, links, path):
+        for link in links:
+            self.download_file(link["href"], path)
+
+    def get_feed_attachments(self, wiki_url, sizes=None):
+        # The first page tells how many there are, the rest of the pages are requested together
+        url = attachments_feed_url(wiki_url, 1)
+        if url is None:
+            return None
+        sizes = sizes if sizes is not None else {}
+        try:
+            total, urls, known = parse_attachments_feed(self.transfer.read(url))
+            sizes.update(known)
+            pages = -(-total // ATTACHMENTS_PAGE_SIZE)
+            for content in self.transfer.read_all([attachments_feed_url(wiki_url, i) for i in range(2, pages + 1)]):
+                _, more, known = parse_attachments_feed(content)
+                urls.extend(more)
+                sizes.update(known)
+        except transfer.ERRORS + (ElementTree.ParseError, AttributeError, ValueError) as e:
+            log.warning("The attachments feed of {} failed, falling back to the browser: {}".format(wiki_url, e))
+            return None
+        return list(dict.fromkeys(urls))
+
+    def plan_work(self, tree):
+        # Pages are known from the tree, attachments and their sizes from the feeds when pages are exported over HTTP
+        wikis = tree.wikis()
+        work = {"pages": len(wikis), "files": 0, "bytes": 0}
+        if not self.direct_export:
+            return work
+
+        def plan_wiki(index):
+            sizes = {}
+            tree.attachments[index] = self.get_feed_attachments(tree.urls[index], sizes)
+            return sizes
+
+        sizes = {}
+        for found in self.planner.map(plan_wiki, wikis):
+            sizes.update(found)
+        # The feeds usually carry the sizes, the rest is measured with HEAD requests
+        unknown = [url for url, size in sizes.items() if size == None]
+        sizes.update(zip(unknown, self.transfer.sizes(unknown)))
+        work["files"] = len(sizes)
+        work["bytes"] = sum(size for size in sizes.values() if not size == None)
+        return work
+
+    def download_wiki_page(self, driver, wiki, selenium_temp_download_dir):
+        # With a direct export the browser only opens the pages that fall back to it
+        page = None
+        attachments = wiki.get("attachments")
+        if self.direct_export:
+            page = self.export_page(wiki["name"], wiki["wiki_path"], wiki["url"])
+            if attachments == None:
+                attachments = self.get_feed_attachments(wiki["url"])
+        if page == None or attachments == None:
+            driver.get(wiki["url"])
+            wait_wiki_page_load(driver)
+        self.download_wiki(
+            driver,
+            wiki["name"],
+            wiki["wiki_path"],
+            wiki["links_path"],
+            wiki["attachments_path"],
+            selenium_temp_download_dir,
+            wiki["url"],
+            attachments,
+            page
+        )
+
+    def phase(self, name):
+        return self.metrics.phase(name) if self.metrics is not None else contextlib.nullcontext()
+
+    def drain(self):
+        # Whatever is still queued after the last page
+        with self.phase("transfer_drain"):
+            self.transfer.join()
+        with self.phase("rewrite_drain"):
+            self.rewriter.join()
+
+    def download_community(self, driver, tree, selenium_temp_download_dir, pool=None):
+        # The pool is a list of (driver, download dir), all extra browsers by default
+        pool = self.browsers if pool is None else pool
+        if self.direct_export:
+            self.share_cookies(driver)
+
+        def download(d, index):
+            # The paths of a page only exist while it is downloaded
+            wiki = tree.wiki(index)
+            wiki["attachments"] = tree.attachments.pop(index, None)
+            self.download_wiki_page(d, wiki, download_dirs[d])
+
+        with self.phase("page_export"):
+            download_dirs = {driver: selenium_temp_download_dir}
+            download_dirs.update(dict(pool))
+            if len(pool) > 0:
+                run_in_pool(list(download_dirs), tree.wikis(), download)
+            else:
+                for index in tree.wikis():
+                    download(driver, index)
+
+        self.drain()
+
+    def share_session(self, driver, pool=None):
+        for pool_driver, _ in (self.browsers if pool is None else pool):
+            copy_session(driver, pool_driver)
+
+    def create_communities_tree(self, driver, community_url, recursive, w3id_login = None, w3id_password = None, pool=None):
+        # The subcommunities are a work queue instead of a recursion, so any depth fits
+        pool = self.browsers if pool is None else pool
+        tree = tr.Tree()
+
+        def scan(scan_driver, task):
+            # Placeholders keep the order of the menus, whatever order the scans finish in
+            index, url = task
+            sub_links = scan_community(scan_driver, tree, index, url, recursive, w3id_login, w3id_password)
+            if len(sub_links) > 0:
+                log.info("--- {} (subcommunities) done".format(tree.names[index]))
+            return [(tree.add(tr.COMMUNITY, index, sub_link), sub_link) for sub_link in sub_links]
+
+        tasks = scan(driver, (tree.add(tr.COMMUNITY, -1, community_url), community_url))
+        if len(pool) > 0:
+            self.share_session(driver, pool)
+            run_in_pool([driver] + [pool_driver for pool_driver, _ in pool], tasks, scan)
+        else:
+            while len(tasks) > 0:
+                tasks = scan(driver, tasks.pop(0)) + tasks
+        log.info("--- {} communities scanned".format(sum(1 for index in tree.walk() if not tree.is_wiki(index))))
+
+        return tree
+
+    def finish(self):
+        if self.driver is not None:
+            self.driver.close()
+            self.driver = None
+        for pool_driver, download_dir in self.browsers:
+            pool_driver.quit()
+            shutil.rmtree(download_dir, ignore_errors=True)
+        self.browsers = []
+        if self.transfer is not None:
+            self.transfer.close()
+            self.transfer = None
+        if self.rewriter is not None:
+            self.rewriter.close()
+            self.rewriter = None
+        for item in self.watchers.values():
+            item.close()
+        self.watchers.clear()
+        self.planner.shutdown()
@@ -0,0 +1,155 @@
+import threading
+import hashlib
+import sqlite3
+import time
+import os
+
+MANIFEST_NAME = ".w3cpull-manifest.db"
+HASH_CHUNK_SIZE = 1024 * 1024
+RESUME_TTL = 12 * 60 * 60
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, root, resume_ttl=RESUME_TTL):
+        self.root = os.path.abspath(root)
+        self.resume_ttl = resume_ttl
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.root, MANIFEST_NAME), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "url TEXT NOT NULL, path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER, "
+            "etag TEXT, last_modified TEXT, sha256 TEXT, run INTEGER, synced REAL, "
+            "PRIMARY KEY (url, path))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_path ON entries (path)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL, finished REAL)"
+        )
+        self.db.commit()
+        self.run, self.resumed = self.start_run()
+
+    def start_run(self):
+        # An interrupted last run is continued, so everything it already synced is skipped, but only while it is
+        # recent: an old one would keep every file it synced from being revalidated
+        with self.lock:
+            row = self.db.execute("SELECT id, started, finished FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+            if row is not None and row["finished"] is None:
+                active = self.db.execute(
+                    "SELECT MAX(synced) AS synced FROM entries WHERE run = ?", (row["id"],)
+                ).fetchone()["synced"]
+                if time.time() - max(row["started"] or 0, active or 0) < self.resume_ttl:
+                    return row["id"], True
+            cursor = self.db.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),))
+            self.db.commit()
+            return cursor.lastrowid, False
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def get(self, url, path):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM entries WHERE url = ? AND path = ?", (url, self.relpath(path))
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def entries(self, kind=None):
+        with self.lock:
+            if kind is None:
+                rows = self.db.execute("SELECT * FROM entries").fetchall()
+            else:
+                rows = self.db.execute("SELECT * FROM entries WHERE kind = ?", (kind,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def urls(self, directory, kind="file"):
+        # The URLs of the files right in a directory, the range is read from the index on the paths
+        prefix = os.path.join(self.relpath(directory), "")
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT url, path FROM entries WHERE path >= ? AND path < ? AND kind = ?",
+                (prefix, prefix[:-1] + chr(ord(os.sep) + 1), kind)
+            ).fetchall()
+        return [row["url"] for row in rows if os.path.join(os.path.dirname(row["path"]), "") == prefix]
+
+    def synced(self, url, path=None):
+        with self.lock:
+            if path is None:
+                row = self.db.execute(
+                    "SELECT path FROM entries WHERE url = ? AND run = ?", (url, self.run)
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    "SELECT path FROM entries WHERE url = ? AND path = ? AND run = ?",
+                    (url, self.relpath(path), self.run)
+                ).fetchone()
+        return row is not None and os.path.exists(os.path.join(self.root, row["path"]))
+
+    def record(self, url, path, kind, size=None, etag=None, last_modified=None, sha256=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(url, path, kind, size, etag, last_modified, sha256, run, synced) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, self.relpath(path), kind, size, etag, last_modified, sha256, self.run, time.time())
+            )
+            self.db.commit()
+
+    def refresh(self, path):
+        # Keeps the entries in line with a file that was modified after the download
+        size = os.path.getsize(path)
+        sha256 = file_sha256(path)
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET size = ?, sha256 = ? WHERE path = ?", (size, sha256, self.relpath(path))
+            )
+            self.db.commit()
+
+    def forget(self, url, path):
+        # Without an entry the next download of the file is not conditional
+        with self.lock:
+            self.db.execute("DELETE FROM entries WHERE url = ? AND path = ?", (url, self.relpath(path)))
+            self.db.commit()
+
+    def touch(self, url, path):
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET run = ?, synced = ? WHERE url = ? AND path = ?",
+                (self.run, time.time(), url, self.relpath(path))
+            )
+            self.db.commit()
+
+    def conditional_headers(self, url, path):
+        # Returns None when the entry was already synced by this run
+        entry = self.get(url, path)
+        if entry is None or not os.path.exists(path) or not os.path.getsize(path) == entry["size"]:
+            return {}
+        if entry["run"] == self.run:
+            return None
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def finish(self):
+        with self.lock:
+            self.db.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), self.run))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,98 @@
+import collections
+import contextlib
+import threading
+import json
+import time
+import os
+
+PROMETHEUS_PREFIX = "w3cpull"
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root = None
+        self.started = time.time()
+        self.phases = collections.OrderedDict()
+        self.wikis = collections.defaultdict(collections.Counter)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+
+    def add(self, wiki, **counters):
+        with self.lock:
+            self.wikis[wiki].update(counters)
+
+    def get(self, wiki, counter):
+        with self.lock:
+            return self.wikis[wiki][counter] if wiki in self.wikis else 0
+
+    def totals(self):
+        with self.lock:
+            totals = collections.Counter()
+            for counters in self.wikis.values():
+                totals.update(counters)
+        return totals
+
+    def wiki_name(self, wiki):
+        if self.root is None or wiki is None:
+            return wiki or ""
+        return os.path.relpath(wiki, self.root)
+
+    def report(self, **extra):
+        with self.lock:
+            totals = collections.Counter()
+            wikis = {}
+            for wiki, counters in self.wikis.items():
+                totals.update(counters)
+                wikis[self.wiki_name(wiki)] = dict(counters)
+            report = {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "phases": dict(self.phases),
+                "totals": dict(totals),
+                "wikis": wikis,
+            }
+        report.update(extra)
+        return report
+
+    def write_json(self, path, **extra):
+        write_atomic(path, json.dumps(self.report(**extra), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path, **extra):
+        report = self.report(**extra)
+        lines = [
+            "# TYPE {}_duration_seconds gauge".format(PROMETHEUS_PREFIX),
+            "{}_duration_seconds {}".format(PROMETHEUS_PREFIX, report["duration"]),
+            "# TYPE {}_phase_seconds gauge".format(PROMETHEUS_PREFIX),
+        ]
+        for name, seconds in report["phases"].items():
+            lines.append('{}_phase_seconds{{phase="{}"}} {}'.format(PROMETHEUS_PREFIX, escape(name), seconds))
+        counters = sorted(set(key for counters in report["wikis"].values() for key in counters))
+        for counter in counters:
+            lines.append("# TYPE {}_{} gauge".format(PROMETHEUS_PREFIX, counter))
+            for wiki, values in sorted(report["wikis"].items()):
+                if counter in values:
+                    lines.append('{}_{}{{wiki="{}"}} {}'.format(PROMETHEUS_PREFIX, counter, escape(wiki), values[counter]))
+        for key, value in extra.items():
+            if isinstance(value, (bool, int, float)):
+                lines.append("{}_{} {}".format(PROMETHEUS_PREFIX, key, int(value) if isinstance(value, bool) else value))
+        write_atomic(path, "\n".join(lines) + "\n")
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_atomic(path, content):
+    # Collectors such as the node exporter may read the file at any moment
+    temp = "{}.tmp".format(path)
+    with open(temp, "w") as f:
+        f.write(content)
+    os.replace(temp, path)
@@ -1,21 +1,115 @@
+from w3cpull.transfer import file_name
+from w3cpull import paths
+import concurrent.futures
+import logging as log
+import urllib.parse
+import threading
+import tempfile
+import html
+import queue
+import shutil
+import time
 import os
 import re
 
-def replace_links(path):
+LINK_PATTERN = re.compile(r"(<a\b[^>]*?\bhref=\")([^\"\s]+)(\")", re.IGNORECASE)
+PARALLEL_THRESHOLD = 16
+
+
+def local_link(match, links=None):
+    link = match.group(2)
+    if not "/api/" in link:
+        return match.group(0)
+    # Files that were not planned by the path index keep the name from their URL
+    name = links.get(paths.url_key(html.unescape(link))) if links is not None else None
+    if name is None:
+        name = file_name(link)
+    return "{}./{}/{}{}".format(match.group(1), paths.LINKS_DIR, urllib.parse.quote(name), match.group(3))
+
+
+def replace_links_in_file(file, links=None):
+    # surrogateescape keeps bytes that are not valid UTF-8 untouched
+    with open(file, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        content = f.read()
+    replaced = LINK_PATTERN.sub(lambda match: local_link(match, links), content)
+    if replaced == content:
+        return False
+
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(file), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(replaced)
+        shutil.copymode(file, temp)
+        os.replace(temp, file)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return True
+
+
+def links_of(file, index):
+    if index is None:
+        return None
+    return index.links(os.path.join(os.path.dirname(file), paths.LINKS_DIR))
+
+
+def replace_links(path, workers=None, index=None):
     files_list = get_files_list(path)
-    links_list = []
-    for file in files_list:
-        with open(file, 'r+') as f:
-            content = f.read()
-            matches = re.findall(r"<a.*>.*<\/a>", content)
-            for match in matches:
-                links = re.findall(r"href=\"([^\s]+)\"", match)
-                for link in links:
-                    if "/api/" in link:
-                        content = content.replace(link, "./links/{}".format(link.rsplit("/", 1)[1]))
-            f.truncate(0)
-            f.write(content)
-        f.close()
+    links_list = [links_of(file, index) for file in files_list]
+    if len(files_list) < PARALLEL_THRESHOLD or workers == 1:
+        for file, links in zip(files_list, links_list):
+            replace_links_in_file(file, links)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(replace_links_in_file, files_list, links_list, chunksize=8))
+
+
+class Rewriter:
+    # Rewrites pages in the background while the next ones are being fetched
+    def __init__(self, manifest=None, metrics=None, archive=None, index=None):
+        self.manifest = manifest
+        self.metrics = metrics
+        self.archive = archive
+        self.index = index
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, name="rewriter", daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while True:
+            file = self.queue.get()
+            try:
+                if file is None:
+                    return
+                start = time.time()
+                if replace_links_in_file(file, links_of(file, self.index)) and self.manifest is not None:
+                    self.manifest.refresh(file)
+                if self.metrics is not None:
+                    self.metrics.add(os.path.dirname(os.path.abspath(file)), rewrites=1, rewrite_seconds=time.time() - start)
+            except Exception as e:
+                # Any error is only this page's, the thread goes on with the next ones
+                log.warning("Failed to replace links in {}: {}".format(file, e))
+                if self.metrics is not None:
+                    self.metrics.add(os.path.dirname(os.path.abspath(file)), errors=1)
+            finally:
+                if file is not None and self.archive is not None:
+                    self.archive.submit(file)
+                self.queue.task_done()
+
+    def submit(self, file):
+        if file.endswith('.html'):
+            self.queue.put(file)
+        elif self.archive is not None:
+            self.archive.submit(file)
+
+    def join(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
 
 def get_files_list(path):
     target_dir = (os.path.abspath(path) if not path[0] == '~' else os.path.expanduser(path))
@@ -0,0 +1,129 @@
+import urllib.parse
+import threading
+import sys
+import os
+
+NAME_MAX = 255
+LINKS_DIR = "links"
+ATTACHMENTS_DIR = "attachments"
+
+
+def url_key(url):
+    # Absolute and root-relative links to the same file have the same key
+    parsed = urllib.parse.urlsplit(url)
+    return "{}?{}".format(parsed.path, parsed.query) if parsed.query else parsed.path
+
+
+def url_name(url):
+    return urllib.parse.unquote(urllib.parse.urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1])
+
+
+def safe_name(name):
+    name = name.replace("/", "_").replace("\0", "_").strip()
+    if name in ("", ".", ".."):
+        name = "_"
+    if len(name.encode("utf-8")) > NAME_MAX:
+        stem, ext = os.path.splitext(name)
+        ext = ext if len(ext.encode("utf-8")) < 32 else ""
+        stem = stem.encode("utf-8")[:NAME_MAX - len(ext.encode("utf-8"))].decode("utf-8", "ignore")
+        name = stem + ext
+    return name
+
+
+def numbered(name, number):
+    stem, ext = os.path.splitext(name)
+    return safe_name("{} ({}){}".format(stem, number, ext))
+
+
+def unique(name, used):
+    name = safe_name(name)
+    candidate, number = name, 1
+    while candidate in used:
+        number += 1
+        candidate = numbered(name, number)
+    used.add(candidate)
+    return candidate
+
+
+class PathIndex:
+    # Plans every local path once, so names never collide and links can be resolved without guessing
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}
+        self.files = {}
+        self.failed = set()
+
+    def reserve(self, directory, key, name):
+        # Called with the lock held, returns the name the key already has in the directory
+        files = self.files.setdefault(directory, {})
+        if key in files:
+            return files[key]
+        files[key] = unique(name, self.names.setdefault(directory, set()))
+        return files[key]
+
+    def plan(self, url, directory, name=None):
+        return self.add(url, directory, name)[0]
+
+    def add(self, url, directory, name=None):
+        # Also tells whether the URL is new in the directory, or failed and may be fetched again under the same name
+        directory = os.path.abspath(directory)
+        key = url_key(url)
+        with self.lock:
+            new = not key in self.files.get(directory, {}) or (directory, key) in self.failed
+            self.failed.discard((directory, key))
+            name = self.reserve(directory, key, name if not name == None else url_name(url))
+        return os.path.join(directory, name), new
+
+    def propose(self, urls, directory):
+        # The names plan would give, without reserving them, so another node can reserve the same ones
+        directory = os.path.abspath(directory)
+        with self.lock:
+            files = dict(self.files.get(directory, {}))
+            used = set(self.names.get(directory, set()))
+        names = []
+        for url in urls:
+            key = url_key(url)
+            if not key in files:
+                files[key] = unique(url_name(url), used)
+            names.append(files[key])
+        return names
+
+    def fail(self, url, directory):
+        with self.lock:
+            self.failed.add((os.path.abspath(directory), url_key(url)))
+
+    def links(self, directory):
+        # A copy of the URL key to file name mapping of one directory
+        with self.lock:
+            return dict(self.files.get(os.path.abspath(directory), {}))
+
+    def build(self, root_path, tree, create=True):
+        # Only the community directory is kept in the index, the names under it are planned among
+        # siblings and forgotten, so the tree keeps one name per node and no paths
+        tree.root = os.path.abspath(root_path)
+        if len(tree) == 0:
+            return tree
+        path = self.plan(tree.urls[0], tree.root, tree.names[0])
+        tree.files[0] = sys.intern(os.path.basename(path))
+        stack = [(0, path)]
+        while len(stack) > 0:
+            index, path = stack.pop()
+            if tree.is_wiki(index):
+                # A subwiki named like one of these directories gets another name
+                used = {LINKS_DIR, ATTACHMENTS_DIR}
+                directories = (os.path.join(path, LINKS_DIR), os.path.join(path, ATTACHMENTS_DIR))
+            else:
+                used = set()
+                directories = (path,)
+            for directory in directories if create else ():
+                os.makedirs(directory, exist_ok=True)
+            planned = {}
+            children = []
+            for child in tree.children(index):
+                key = url_key(tree.urls[child])
+                if not key in planned:
+                    planned[key] = unique(url_name(tree.urls[child]) if tree.is_wiki(child) else tree.names[child], used)
+                tree.files[child] = sys.intern(planned[key])
+                children.append((child, os.path.join(path, tree.files[child])))
+            stack.extend(reversed(children))
+        return tree
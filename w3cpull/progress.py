@@ -0,0 +1,131 @@
+import collections
+import threading
+import datetime
+import json
+import time
+import sys
+
+MODES = ("bar", "json")
+DEFAULT_INTERVAL = 2.0
+RATE_WINDOW = 60
+STALL_AFTER = 120
+BAR_WIDTH = 24
+
+
+def duration(seconds):
+    return str(datetime.timedelta(seconds=int(seconds))) if not seconds == None else "--:--:--"
+
+
+def megabytes(size):
+    return "{:.1f} MB".format(size / 2 ** 20)
+
+
+class Progress:
+    # Reads the transfer counters of the metrics against the planned work and reports throughput and ETA
+    def __init__(self, metrics, mode="bar", stream=None, interval=DEFAULT_INTERVAL):
+        self.metrics = metrics
+        self.mode = mode
+        self.stream = stream if stream is not None else (sys.stdout if mode == "json" else sys.stderr)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.planned = collections.Counter()
+        self.samples = collections.deque()
+        self.changed = time.time()
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def plan(self, **work):
+        # Called once per community with its pages, known attachments and their total size
+        with self.lock:
+            self.planned.update(work)
+        self.emit("plan", pages=work.get("pages", 0), files=work.get("files", 0), bytes=work.get("bytes", 0))
+
+    def state(self):
+        now = time.time()
+        totals = self.metrics.totals()
+        with self.lock:
+            planned = dict(self.planned)
+        pages = totals["pages"]
+        files = totals["files"] + totals["deduplicated"] + totals["not_modified"] + totals["errors"]
+        size = totals["bytes"] + totals["deduplicated_bytes"]
+        # Links are only known once their page is exported, so the totals grow while the run goes on
+        pages_total = max(planned.get("pages", 0), pages)
+        files_total = max(planned.get("files", 0), totals["queued"], files)
+        # The files still to come are as large as the ones so far, unless the plan knows better
+        average = size / files if files > 0 else 0
+        bytes_total = max(size + (files_total - files) * average, planned.get("bytes", 0))
+
+        fractions = [done / total for done, total in ((pages, pages_total), (size, bytes_total)) if total > 0]
+        done = sum(fractions) / len(fractions) if len(fractions) > 0 else 0.0
+        key = (pages, files, size)
+        if not key == self.last:
+            self.last = key
+            self.changed = now
+        self.samples.append((now, done, size))
+        while len(self.samples) > 2 and now - self.samples[0][0] > RATE_WINDOW:
+            self.samples.popleft()
+        first = self.samples[0]
+        elapsed = now - first[0]
+        rate = (done - first[1]) / elapsed if elapsed > 0 else 0.0
+        return {
+            "time": now,
+            "pages": pages,
+            "pages_total": pages_total,
+            "files": files,
+            "files_total": files_total,
+            "bytes": size,
+            "bytes_total": int(bytes_total),
+            "done": round(done, 4),
+            "bytes_per_second": (size - first[2]) / elapsed if elapsed > 0 else 0.0,
+            "eta": (1.0 - done) / rate if rate > 0 else None,
+            "stalled": now - self.changed,
+        }
+
+    def emit(self, event, **values):
+        if self.mode == "json":
+            values["event"] = event
+            values.setdefault("time", time.time())
+            self.write(json.dumps(values, sort_keys=True) + "\n")
+
+    def render(self, state):
+        filled = int(BAR_WIDTH * state["done"])
+        line = "[{}{}] {:>3.0f}% {}/{} pages {}/{} files {} / ~{} {}/s ETA {}".format(
+            "#" * filled, "-" * (BAR_WIDTH - filled), state["done"] * 100,
+            state["pages"], state["pages_total"], state["files"], state["files_total"],
+            megabytes(state["bytes"]), megabytes(state["bytes_total"]), megabytes(state["bytes_per_second"]),
+            duration(state["eta"])
+        )
+        if state["stalled"] > STALL_AFTER:
+            line += " (stalled for {})".format(duration(state["stalled"]))
+        return line
+
+    def report(self, final=False):
+        state = self.state()
+        if self.mode == "json":
+            self.emit("done" if final else "progress", **state)
+        elif self.stream.isatty():
+            self.write("\r\033[K" + self.render(state) + ("\n" if final else ""))
+        else:
+            self.write(self.render(state) + "\n")
+
+    def write(self, text):
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="progress", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report(True)
@@ -0,0 +1,151 @@
+import email.utils
+import threading
+import asyncio
+import random
+import time
+
+THROTTLE_STATUSES = (429, 503)
+RETRY_ATTEMPTS = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 120.0
+POLL_INTERVAL = 0.05
+
+
+def retry_after(headers):
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, delay=None):
+    # Full jitter keeps the workers that were throttled together from retrying together
+    if delay is None:
+        delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+    return delay + random.uniform(0, BASE_BACKOFF)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        # Takes a token now and returns how long to wait before using it
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class AdaptiveLimit:
+    # Additive increase after a full window of successes, multiplicative decrease on throttling
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        with self.condition:
+            if self.active >= int(self.limit):
+                return False
+            self.active += 1
+            return True
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, ok=True):
+        with self.condition:
+            self.active -= 1
+            if ok:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def decrease(self):
+        with self.condition:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.successes = 0
+
+
+class RateLimiter:
+    def __init__(self, rate=None, host_rate=None, concurrency=8):
+        self.rate = rate
+        self.host_rate = host_rate
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.bucket = TokenBucket(rate) if rate else None
+        self.buckets = {}
+        self.limits = {}
+        self.blocked = {}
+
+    def limit(self, host):
+        with self.lock:
+            if not host in self.limits:
+                self.limits[host] = AdaptiveLimit(self.concurrency)
+            return self.limits[host]
+
+    def delay(self, host):
+        with self.lock:
+            delay = max(self.blocked.get(host, 0.0) - time.monotonic(), 0.0)
+            if self.bucket is not None:
+                delay = max(delay, self.bucket.reserve())
+            if self.host_rate:
+                if not host in self.buckets:
+                    self.buckets[host] = TokenBucket(self.host_rate)
+                delay = max(delay, self.buckets[host].reserve())
+            return delay
+
+    def wait(self, host):
+        delay = self.delay(host)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, host):
+        delay = self.delay(host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire(self, host):
+        self.limit(host).acquire()
+
+    def try_acquire(self, host):
+        return self.limit(host).try_acquire()
+
+    async def acquire_async(self, host):
+        limit = self.limit(host)
+        while not limit.try_acquire():
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self, host, ok=True):
+        self.limit(host).release(ok)
+
+    def throttled(self, host, attempt, delay=None):
+        # Returns how long the caller should wait before retrying
+        self.limit(host).decrease()
+        delay = backoff(attempt, delay)
+        with self.lock:
+            self.blocked[host] = max(self.blocked.get(host, 0.0), time.monotonic() + delay)
+        return delay
@@ -0,0 +1,93 @@
+import threading
+import tempfile
+import platform
+import shutil
+import fcntl
+import os
+
+BLOBS_NAME = ".w3cpull-blobs"
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.inflight = {}
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def claim(self, url):
+        # Returns ("done", blob), ("wait", event) or ("fetch", None) for the caller to download
+        with self.lock:
+            if url in self.blobs:
+                return "done", self.blobs[url]
+            if url in self.inflight:
+                return "wait", self.inflight[url]
+            self.inflight[url] = threading.Event()
+            return "fetch", None
+
+    def temp(self):
+        fd, path = tempfile.mkstemp(dir=self.temp_dir)
+        os.close(fd)
+        return path
+
+    def add(self, url, temp, size, sha256, etag=None, last_modified=None):
+        path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # Same content under another URL, keep the blob that is already linked
+            os.remove(temp)
+        else:
+            os.replace(temp, path)
+        blob = {"sha256": sha256, "size": size, "etag": etag, "last_modified": last_modified}
+        with self.lock:
+            self.blobs[url] = blob
+            self.inflight.pop(url).set()
+        return blob
+
+    def release(self, url, temp=None):
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
+        with self.lock:
+            event = self.inflight.pop(url, None)
+        if event is not None:
+            event.set()
+
+    def materialize(self, blob, dest):
+        path = self.blob_path(blob["sha256"])
+        try:
+            os.remove(dest)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(path, dest)
+            return
+        except OSError:
+            pass
+        if platform.system() == "Linux":
+            try:
+                reflink(path, dest)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(path, dest)
+
+    def prune(self):
+        # Blobs that are no longer linked from the tree belong to replaced files
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.path == self.temp_dir:
+                continue
+            for blob in os.scandir(entry.path):
+                if blob.stat().st_nlink == 1:
+                    os.remove(blob.path)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
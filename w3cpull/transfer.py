@@ -0,0 +1,816 @@
+from w3cpull import ratelimit
+import concurrent.futures
+import logging as log
+import urllib.parse
+import threading
+import requests
+import hashlib
+import asyncio
+import queue
+import time
+import os
+
+aiohttp = None
+yarl = None
+
+
+class TruncatedError(OSError):
+    pass
+
+
+class RedirectedError(OSError):
+    pass
+
+
+ERRORS = (requests.RequestException, OSError)
+RESUMABLE = (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, TruncatedError)
+ASYNC_RESUMABLE = (asyncio.TimeoutError, TruncatedError)
+
+
+def load_aiohttp():
+    # Importing aiohttp takes longer than the rest of the package, only the async backend needs it
+    global aiohttp, yarl, ERRORS, ASYNC_RESUMABLE
+    if aiohttp is None:
+        try:
+            import aiohttp as client
+            import yarl as urls
+        except ImportError:
+            return False
+        aiohttp, yarl = client, urls
+        ERRORS += (aiohttp.ClientError, asyncio.TimeoutError)
+        ASYNC_RESUMABLE = (
+            aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError, TruncatedError
+        )
+    return True
+
+DEFAULT_WORKERS = 8
+DEFAULT_BACKEND = "thread"
+DEFAULT_SEGMENTS = 4
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+RESUME_ATTEMPTS = 5
+PART_SUFFIX = ".part"
+CLAIM_POLL = 0.05
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+TIMEOUT = (30, 60)
+
+
+def file_name(url):
+    return urllib.parse.unquote(url.rsplit("/", 1)[1].rsplit("?", 1)[0])
+
+
+def chunk_size(length):
+    # Small files are read in one go, big ones in chunks that keep the loop cheap
+    if length is None:
+        return 4 * MIN_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, length // 64))
+
+
+def content_length(headers):
+    # The decoded size of a compressed body is not known in advance
+    if not headers.get("Content-Encoding", "identity") in ("identity", ""):
+        return None
+    try:
+        return int(headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def validator(headers):
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def range_headers(headers, start, end=None, if_range=None):
+    headers = {
+        key: value for key, value in headers.items()
+        if not key in ("If-None-Match", "If-Modified-Since")
+    }
+    headers["Range"] = "bytes={}-{}".format(start, "" if end is None else end)
+    if if_range:
+        headers["If-Range"] = if_range
+    return headers
+
+
+def segments(length, count):
+    size = -(-length // count)
+    return [(start, min(start + size, length) - 1) for start in range(0, length, size)]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MAX_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def host(url):
+    return urllib.parse.urlsplit(url).hostname
+
+
+class Transfer:
+    manifest = None
+    store = None
+    limiter = None
+    metrics = None
+    archive = None
+    paths = None
+    segments = DEFAULT_SEGMENTS
+    follow_redirects = True
+
+    def wiki(self, path, kind="file"):
+        # Pages are saved into the wiki directory, files into its links/attachments
+        return os.path.abspath(path if kind == "page" else os.path.dirname(path))
+
+    def count(self, wiki, **counters):
+        if self.metrics is not None:
+            self.metrics.add(wiki, **counters)
+
+    def throttled(self, url, status, headers, attempt, wiki=None):
+        self.count(wiki, requests=1)
+        if not status in ratelimit.THROTTLE_STATUSES or attempt >= ratelimit.RETRY_ATTEMPTS:
+            return False
+        self.count(wiki, retries=1)
+        delay = self.limiter.throttled(host(url), attempt, ratelimit.retry_after(headers))
+        log.info("Throttled with {} on {}, retrying in {:.1f} s".format(status, url, delay))
+        return True
+
+    def redirected(self, status):
+        # Without following redirects, an expired session cannot pass the sign-in page off as the file
+        return not self.follow_redirects and status in REDIRECT_STATUSES
+
+    def splittable(self, status, headers, length):
+        return (
+            self.segments > 1 and status == 200 and length is not None
+            and length >= SEGMENT_THRESHOLD and headers.get("Accept-Ranges") == "bytes"
+        )
+
+    def slots(self, url):
+        # Every segment after the first holds a slot of the host, a host below its limit is not split
+        taken = 0
+        while taken < self.segments - 1 and self.limiter.try_acquire(host(url)):
+            taken += 1
+        return taken
+
+    def free(self, url, slots, ok):
+        for _ in range(slots):
+            self.limiter.release(host(url), ok)
+
+    def reserve(self, url, path, name=None):
+        # Names are planned when a file is queued, so pages can link to it before it arrives
+        if self.paths is not None:
+            return self.paths.plan(url, path, name)
+        return os.path.join(path, name if not name == None else file_name(url))
+
+    def queued(self, url, path, name=None):
+        # A file linked twice from one page is downloaded once
+        if self.paths is None:
+            return False
+        if not self.paths.add(url, path, name)[1]:
+            return True
+        self.count(self.wiki(path), queued=1)
+        return False
+
+    def prepare(self, url, path, name=None):
+        # Headers are None when the file is already up to date
+        dest = self.reserve(url, path, name)
+        if self.manifest is None:
+            return dest, {}
+        return dest, self.manifest.conditional_headers(url, dest)
+
+    def complete(self, url, dest, status, headers, size, digest, kind="file"):
+        if self.manifest is None:
+            return
+        if status == 304:
+            self.manifest.touch(url, dest)
+        elif 200 <= status < 300:
+            self.manifest.record(
+                url, dest, kind, size,
+                headers.get("ETag"), headers.get("Last-Modified"), digest.hexdigest()
+            )
+
+    def claim(self, url):
+        while True:
+            state, value = self.store.claim(url)
+            if not state == "wait":
+                return state, value
+            value.wait()
+
+    def begin(self, url, dest, kind="file", claimed=None):
+        # Returns where to write the response, or None if the store already has the content
+        if self.store is None:
+            return dest + PART_SUFFIX
+        state, value = claimed if claimed is not None else self.claim(url)
+        if state == "fetch":
+            return self.store.temp()
+        self.store.materialize(value, dest)
+        self.count(self.wiki(os.path.dirname(dest), kind), deduplicated=1, deduplicated_bytes=value["size"])
+        if self.manifest is not None:
+            self.manifest.record(
+                url, dest, kind, value["size"], value["etag"], value["last_modified"], value["sha256"]
+            )
+        self.pack(dest, kind)
+        return None
+
+    def end(self, url, dest, target, status, headers, size, digest, kind="file"):
+        if self.store is not None:
+            if 200 <= status < 300:
+                blob = self.store.add(
+                    url, target, size, digest.hexdigest(), headers.get("ETag"), headers.get("Last-Modified")
+                )
+                self.store.materialize(blob, dest)
+            else:
+                self.store.release(url, target)
+        elif 200 <= status < 300:
+            os.replace(target, dest)
+        elif os.path.exists(target):
+            os.remove(target)
+        if 200 <= status < 300:
+            self.count(self.wiki(os.path.dirname(dest), kind), files=1, bytes=size)
+        elif status == 304:
+            self.count(self.wiki(os.path.dirname(dest), kind), not_modified=1)
+        self.complete(url, dest, status, headers, size, digest, kind)
+        if 200 <= status < 300:
+            self.pack(dest, kind)
+
+    def failed(self, url, path):
+        # A file that failed can be submitted again, the error counter tells the caller that it should be
+        if self.paths is not None:
+            self.paths.fail(url, path)
+        self.count(self.wiki(path), errors=1)
+
+    def submit_all(self, urls, path, names=None):
+        # Names planned by another node are kept, so every file of a batch has the one it was given
+        for url, name in zip(urls, names if names is not None else [None] * len(urls)):
+            self.submit(url, path, name)
+
+    def pack(self, dest, kind="file"):
+        # Pages are packed by the rewriter once their links are local
+        if self.archive is not None and not kind == "page":
+            self.archive.submit(dest)
+
+    def abort(self, url, target):
+        if self.store is not None:
+            self.store.release(url, target)
+        elif os.path.exists(target):
+            os.remove(target)
+
+
+class ThreadTransfer(Transfer):
+    def __init__(self, workers=DEFAULT_WORKERS, manifest=None, store=None, segments=DEFAULT_SEGMENTS, limiter=None, metrics=None, archive=None, paths=None):
+        self.workers = workers
+        self.manifest = manifest
+        self.store = store
+        self.segments = segments
+        self.limiter = limiter if limiter is not None else ratelimit.RateLimiter(concurrency=workers)
+        self.metrics = metrics
+        self.archive = archive
+        self.paths = paths
+        self.segment_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(segments, 1), thread_name_prefix="segment"
+        )
+        # Every thread keeps a session, so the reads run on threads that live as long as the engine
+        self.read_pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="read")
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.sessions = []
+        self.sessions_lock = threading.Lock()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.worker, name="transfer-{}".format(i), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.local.session = session
+            with self.sessions_lock:
+                session.cookies.update(self.cookies)
+                self.sessions.append(session)
+        return session
+
+    def set_cookies(self, cookies):
+        with self.sessions_lock:
+            for cookie in cookies:
+                self.cookies.set(
+                    cookie["name"], cookie["value"],
+                    domain=cookie.get("domain", ""), path=cookie.get("path", "/")
+                )
+            for session in self.sessions:
+                session.cookies.update(self.cookies)
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.fetch(*item)
+            except ERRORS as e:
+                log.warning("Failed to download {}: {}".format(item[0], e))
+                self.failed(item[0], item[1])
+            except Exception as e:
+                # A bug must not stop the worker, or join() would wait for its queue forever
+                log.exception("Failed to download {}: {}".format(item[0], e))
+                self.failed(item[0], item[1])
+            finally:
+                self.queue.task_done()
+
+    def fetch(self, url, path, name=None, kind="file"):
+        dest, headers = self.prepare(url, path, name)
+        if headers is None:
+            return dest
+        target = self.begin(url, dest, kind)
+        if target is None:
+            return dest
+        wiki = self.wiki(path, kind)
+        start = time.time()
+        try:
+            self.limiter.acquire(host(url))
+            ok = False
+            try:
+                status, response_headers, size, digest = self.stream(url, target, headers, wiki)
+                ok = True
+            finally:
+                self.limiter.release(host(url), ok)
+                self.count(wiki, transfer_seconds=time.time() - start)
+            self.end(url, dest, target, status, response_headers, size, digest, kind)
+        except BaseException:
+            self.abort(url, target)
+            raise
+        return dest
+
+    def read(self, url):
+        self.limiter.acquire(host(url))
+        ok = False
+        try:
+            with self.get(url, {}) as r:
+                r.raise_for_status()
+                content = r.content
+            ok = True
+            return content
+        finally:
+            self.limiter.release(host(url), ok)
+
+    def read_all(self, urls):
+        return list(self.read_pool.map(self.read, urls))
+
+    def size(self, url):
+        # Only an estimate, a file that cannot be measured has no size
+        self.limiter.acquire(host(url))
+        ok = False
+        try:
+            r = self.session().head(url, allow_redirects=True, timeout=TIMEOUT)
+            ok = True
+            return content_length(r.headers) if r.status_code == 200 else None
+        except ERRORS:
+            return None
+        finally:
+            self.limiter.release(host(url), ok)
+
+    def sizes(self, urls):
+        return list(self.read_pool.map(self.size, urls))
+
+    def head(self, url):
+        # The status and headers of a file without its content, throttled responses are retried
+        self.limiter.acquire(host(url))
+        ok = False
+        try:
+            attempt = 0
+            while True:
+                self.limiter.wait(host(url))
+                r = self.session().head(url, allow_redirects=self.follow_redirects, timeout=TIMEOUT)
+                if self.redirected(r.status_code):
+                    raise RedirectedError("{} was redirected to {}".format(url, r.headers.get("Location")))
+                if not self.throttled(url, r.status_code, r.headers, attempt):
+                    ok = True
+                    return r.status_code, r.headers
+                attempt += 1
+        finally:
+            self.limiter.release(host(url), ok)
+
+    def get(self, url, headers, wiki=None):
+        attempt = 0
+        while True:
+            self.limiter.wait(host(url))
+            r = self.session().get(url, headers=headers, stream=True, allow_redirects=self.follow_redirects, timeout=TIMEOUT)
+            if self.redirected(r.status_code):
+                r.close()
+                raise RedirectedError("{} was redirected to {}".format(url, r.headers.get("Location")))
+            if not self.throttled(url, r.status_code, r.headers, attempt, wiki):
+                return r
+            r.close()
+            attempt += 1
+
+    def stream(self, url, target, headers, wiki=None):
+        r = self.get(url, headers, wiki)
+        try:
+            r.raise_for_status()
+            status, response_headers = r.status_code, r.headers
+            digest = hashlib.sha256()
+            size = 0
+            if status == 304:
+                return status, response_headers, size, digest
+            length = content_length(response_headers)
+            slots = self.slots(url) if self.splittable(status, response_headers, length) else 0
+            if slots > 0:
+                r.close()
+                return status, response_headers, length, self.download_segments(url, target, response_headers, length, slots, wiki)
+
+            attempts = 0
+            with open(target, "wb") as f:
+                while True:
+                    try:
+                        if r is None:
+                            # A reconnect that fails counts as an attempt too
+                            r = self.get(url, range_headers(headers, size, None, validator(response_headers)), wiki)
+                            r.raise_for_status()
+                            if not r.status_code == 206:
+                                # The range was ignored or the file changed, so start over
+                                f.seek(0)
+                                f.truncate()
+                                digest = hashlib.sha256()
+                                size = 0
+                        for chunk in r.iter_content(chunk_size(length)):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                        if length is None or size >= length:
+                            break
+                        raise TruncatedError("Connection closed after {} of {} bytes".format(size, length))
+                    except RESUMABLE:
+                        attempts += 1
+                        if attempts > RESUME_ATTEMPTS:
+                            raise
+                        log.info("Resuming {} from byte {}".format(url, size))
+                        self.count(wiki, resumes=1)
+                        if r is not None:
+                            r.close()
+                            r = None
+                        time.sleep(ratelimit.backoff(attempts - 1))
+            return status, response_headers, size, digest
+        finally:
+            if r is not None:
+                r.close()
+
+    def download_segments(self, url, target, headers, length, slots, wiki=None):
+        # The first segment runs on the slot of the download
+        ok = False
+        try:
+            with open(target, "wb") as f:
+                f.truncate(length)
+            futures = [
+                self.segment_pool.submit(self.download_segment, url, target, start, end, validator(headers), wiki)
+                for start, end in segments(length, slots + 1)
+            ]
+            for future in futures:
+                future.result()
+            ok = True
+        finally:
+            self.free(url, slots, ok)
+        return file_digest(target)
+
+    def download_segment(self, url, target, start, end, if_range, wiki=None):
+        offset = start
+        attempts = 0
+        with open(target, "r+b") as f:
+            while offset <= end:
+                try:
+                    with self.get(url, range_headers({}, offset, end, if_range), wiki) as r:
+                        r.raise_for_status()
+                        if not r.status_code == 206:
+                            raise OSError("{} changed while it was downloaded in segments".format(url))
+                        f.seek(offset)
+                        for chunk in r.iter_content(chunk_size(end - start + 1)):
+                            chunk = chunk[:end + 1 - offset]
+                            f.write(chunk)
+                            offset += len(chunk)
+                    if offset <= end:
+                        raise TruncatedError("Segment of {} closed at byte {}".format(url, offset))
+                except RESUMABLE:
+                    attempts += 1
+                    if attempts > RESUME_ATTEMPTS:
+                        raise
+                    time.sleep(ratelimit.backoff(attempts - 1))
+
+    def submit(self, url, path, name=None):
+        if not self.queued(url, path, name):
+            self.queue.put((url, path, name))
+
+    def join(self):
+        self.queue.join()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.segment_pool.shutdown()
+        self.read_pool.shutdown()
+        for session in self.sessions:
+            session.close()
+        self.threads = []
+        self.sessions = []
+
+
+class AsyncTransfer(Transfer):
+    def __init__(self, workers=DEFAULT_WORKERS, manifest=None, store=None, segments=DEFAULT_SEGMENTS, limiter=None, metrics=None, archive=None, paths=None):
+        if not load_aiohttp():
+            raise RuntimeError(
+                "The async I/O backend requires aiohttp (pip install w3cpull[async])"
+            )
+        self.workers = workers
+        self.manifest = manifest
+        self.store = store
+        self.segments = segments
+        self.limiter = limiter if limiter is not None else ratelimit.RateLimiter(concurrency=workers)
+        self.metrics = metrics
+        self.archive = archive
+        self.paths = paths
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="transfer-loop", daemon=True)
+        self.thread.start()
+        self.call(self.open())
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def open(self):
+        # Both objects bind to the running loop, so they are created inside it
+        self.semaphore = asyncio.Semaphore(self.workers)
+        # Only stalled reads time out, large files may take any time in total
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.workers),
+            timeout=aiohttp.ClientTimeout(total=None, connect=TIMEOUT[0], sock_read=TIMEOUT[1])
+        )
+
+    async def download(self, url, path, name=None, kind="file"):
+        dest, headers = self.prepare(url, path, name)
+        if headers is None:
+            return dest
+        claimed = await self.claim_async(url) if self.store is not None else None
+        # Linking the stored content touches the disk, so it is done outside of the loop
+        try:
+            target = await self.loop.run_in_executor(None, self.begin, url, dest, kind, claimed)
+        except BaseException:
+            if claimed is not None and claimed[0] == "fetch":
+                self.store.release(url)
+            raise
+        if target is None:
+            return dest
+        wiki = self.wiki(path, kind)
+        start = time.time()
+        try:
+            async with self.semaphore:
+                await self.limiter.acquire_async(host(url))
+                ok = False
+                try:
+                    status, response_headers, size, digest = await self.stream(url, target, headers, wiki)
+                    ok = True
+                finally:
+                    self.limiter.release(host(url), ok)
+                    self.count(wiki, transfer_seconds=time.time() - start)
+            self.end(url, dest, target, status, response_headers, size, digest, kind)
+        except BaseException:
+            self.abort(url, target)
+            raise
+        return dest
+
+    async def claim_async(self, url):
+        # The same URL in flight is waited for in the loop, a blocked executor thread could be the one that
+        # download needs to hash its segments
+        while True:
+            state, value = self.store.claim(url)
+            if not state == "wait":
+                return state, value
+            while not value.is_set():
+                await asyncio.sleep(CLAIM_POLL)
+
+    async def load(self, url):
+        async with self.semaphore:
+            await self.limiter.acquire_async(host(url))
+            ok = False
+            try:
+                async with await self.get(url, {}) as r:
+                    r.raise_for_status()
+                    content = await r.read()
+                ok = True
+                return content
+            finally:
+                self.limiter.release(host(url), ok)
+
+    async def gather(self, urls):
+        return await asyncio.gather(*[self.load(url) for url in urls])
+
+    def read(self, url):
+        return self.call(self.load(url))
+
+    def read_all(self, urls):
+        return self.call(self.gather(urls))
+
+    async def measure(self, url):
+        async with self.semaphore:
+            await self.limiter.acquire_async(host(url))
+            ok = False
+            try:
+                async with self.session.head(url, allow_redirects=True) as r:
+                    ok = True
+                    return content_length(r.headers) if r.status == 200 else None
+            except ERRORS:
+                return None
+            finally:
+                self.limiter.release(host(url), ok)
+
+    async def measure_all(self, urls):
+        return await asyncio.gather(*[self.measure(url) for url in urls])
+
+    def sizes(self, urls):
+        return self.call(self.measure_all(urls))
+
+    async def get(self, url, headers, wiki=None):
+        attempt = 0
+        while True:
+            await self.limiter.wait_async(host(url))
+            r = await self.session.get(url, headers=headers, allow_redirects=self.follow_redirects)
+            if self.redirected(r.status):
+                r.release()
+                raise RedirectedError("{} was redirected to {}".format(url, r.headers.get("Location")))
+            if not self.throttled(url, r.status, r.headers, attempt, wiki):
+                return r
+            r.release()
+            attempt += 1
+
+    async def stream(self, url, target, headers, wiki=None):
+        r = await self.get(url, headers, wiki)
+        try:
+            r.raise_for_status()
+            status, response_headers = r.status, r.headers
+            digest = hashlib.sha256()
+            size = 0
+            if status == 304:
+                return status, response_headers, size, digest
+            length = content_length(response_headers)
+            slots = self.slots(url) if self.splittable(status, response_headers, length) else 0
+            if slots > 0:
+                r.close()
+                digest = await self.download_segments(url, target, response_headers, length, slots, wiki)
+                return status, response_headers, length, digest
+
+            attempts = 0
+            with open(target, "wb") as f:
+                while True:
+                    try:
+                        if r is None:
+                            # A reconnect that fails counts as an attempt too
+                            r = await self.get(url, range_headers(headers, size, None, validator(response_headers)), wiki)
+                            r.raise_for_status()
+                            if not r.status == 206:
+                                # The range was ignored or the file changed, so start over
+                                f.seek(0)
+                                f.truncate()
+                                digest = hashlib.sha256()
+                                size = 0
+                        async for chunk in r.content.iter_chunked(chunk_size(length)):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                        if length is None or size >= length:
+                            break
+                        raise TruncatedError("Connection closed after {} of {} bytes".format(size, length))
+                    except ASYNC_RESUMABLE:
+                        attempts += 1
+                        if attempts > RESUME_ATTEMPTS:
+                            raise
+                        log.info("Resuming {} from byte {}".format(url, size))
+                        self.count(wiki, resumes=1)
+                        if r is not None:
+                            r.close()
+                            r = None
+                        await asyncio.sleep(ratelimit.backoff(attempts - 1))
+            return status, response_headers, size, digest
+        finally:
+            if r is not None:
+                r.release()
+
+    async def download_segments(self, url, target, headers, length, slots, wiki=None):
+        # The first segment runs on the slot of the download
+        ok = False
+        try:
+            with open(target, "wb") as f:
+                f.truncate(length)
+            await asyncio.gather(*[
+                self.download_segment(url, target, start, end, validator(headers), wiki)
+                for start, end in segments(length, slots + 1)
+            ])
+            ok = True
+        finally:
+            self.free(url, slots, ok)
+        return await self.loop.run_in_executor(None, file_digest, target)
+
+    async def download_segment(self, url, target, start, end, if_range, wiki=None):
+        offset = start
+        attempts = 0
+        with open(target, "r+b") as f:
+            while offset <= end:
+                try:
+                    async with await self.get(url, range_headers({}, offset, end, if_range), wiki) as r:
+                        r.raise_for_status()
+                        if not r.status == 206:
+                            raise OSError("{} changed while it was downloaded in segments".format(url))
+                        f.seek(offset)
+                        async for chunk in r.content.iter_chunked(chunk_size(end - start + 1)):
+                            chunk = chunk[:end + 1 - offset]
+                            f.write(chunk)
+                            offset += len(chunk)
+                    if offset <= end:
+                        raise TruncatedError("Segment of {} closed at byte {}".format(url, offset))
+                except ASYNC_RESUMABLE:
+                    attempts += 1
+                    if attempts > RESUME_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(ratelimit.backoff(attempts - 1))
+
+    async def guarded_download(self, url, path, name=None):
+        try:
+            await self.download(url, path, name)
+        except ERRORS as e:
+            log.warning("Failed to download {}: {}".format(url, e))
+            self.failed(url, path)
+        except Exception as e:
+            log.exception("Failed to download {}: {}".format(url, e))
+            self.failed(url, path)
+
+    def fetch(self, url, path, name=None, kind="file"):
+        return self.call(self.download(url, path, name, kind))
+
+    async def update_cookies(self, cookies):
+        for cookie in cookies:
+            domain = cookie.get("domain", "").lstrip(".")
+            self.session.cookie_jar.update_cookies(
+                {cookie["name"]: cookie["value"]},
+                response_url=yarl.URL("https://{}/".format(domain))
+            )
+
+    def set_cookies(self, cookies):
+        self.call(self.update_cookies(cookies))
+
+    def submit(self, url, path, name=None):
+        if self.queued(url, path, name):
+            return
+        future = asyncio.run_coroutine_threadsafe(self.guarded_download(url, path, name), self.loop)
+        with self.pending_lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    async def download_all(self, items, path):
+        await asyncio.gather(*[self.guarded_download(url, path, name) for url, name in items])
+
+    def submit_all(self, urls, path, names=None):
+        # One future for the whole batch instead of one hop to the loop per file
+        items = zip(urls, names if names is not None else [None] * len(urls))
+        items = [(url, name) for url, name in items if not self.queued(url, path, name)]
+        future = asyncio.run_coroutine_threadsafe(self.download_all(items, path), self.loop)
+        with self.pending_lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        with self.pending_lock:
+            self.pending.discard(future)
+
+    def join(self):
+        while True:
+            with self.pending_lock:
+                futures = list(self.pending)
+            if len(futures) == 0:
+                break
+            concurrent.futures.wait(futures)
+
+    def close(self):
+        self.join()
+        self.call(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+BACKENDS = {
+    "thread": ThreadTransfer,
+    "async": AsyncTransfer,
+}
+
+
+def init(workers=DEFAULT_WORKERS, backend=DEFAULT_BACKEND, manifest=None, store=None, segments=DEFAULT_SEGMENTS, limiter=None, metrics=None, archive=None, paths=None):
+    return BACKENDS[backend](workers, manifest, store, segments, limiter, metrics, archive, paths)
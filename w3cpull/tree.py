@@ -0,0 +1,134 @@
+from w3cpull import paths
+import threading
+import array
+import json
+import sys
+import os
+
+COMMUNITY = 0
+WIKI = 1
+FORMAT_VERSION = 1
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Tree:
+    # One row per community or wiki in flat arrays, the children of a node are chained through sibling indices.
+    # Paths are not stored, only the planned name of every node, and every traversal is iterative.
+    __slots__ = ("lock", "kinds", "parents", "first", "last", "next", "urls", "names", "files", "root", "attachments")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = bytearray()
+        self.parents = array.array("q")
+        self.first = array.array("q")
+        self.last = array.array("q")
+        self.next = array.array("q")
+        self.urls = []
+        self.names = []
+        self.files = []
+        self.root = None
+        self.attachments = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add(self, kind, parent, url, name=None):
+        # Scans of several browsers add nodes at the same time, the order among siblings is the order of the calls
+        with self.lock:
+            index = len(self.kinds)
+            self.kinds.append(kind)
+            self.parents.append(parent)
+            self.first.append(-1)
+            self.last.append(-1)
+            self.next.append(-1)
+            self.urls.append(url)
+            self.names.append(intern(name))
+            self.files.append(None)
+            if parent >= 0:
+                if self.first[parent] < 0:
+                    self.first[parent] = index
+                else:
+                    self.next[self.last[parent]] = index
+                self.last[parent] = index
+        return index
+
+    def rename(self, index, name):
+        self.names[index] = intern(name)
+
+    def is_wiki(self, index):
+        return self.kinds[index] == WIKI
+
+    def children(self, index):
+        child = self.first[index]
+        while child >= 0:
+            yield child
+            child = self.next[child]
+
+    def walk(self, index=0):
+        # Preorder, parents always come before their children
+        if len(self) == 0:
+            return
+        stack = [index]
+        while len(stack) > 0:
+            index = stack.pop()
+            yield index
+            stack.extend(reversed(list(self.children(index))))
+
+    def wikis(self, index=0):
+        return array.array("q", (i for i in self.walk(index) if self.kinds[i] == WIKI))
+
+    def path(self, index):
+        parts = []
+        while index >= 0:
+            parts.append(self.files[index])
+            index = self.parents[index]
+        return os.path.join(self.root, *reversed(parts))
+
+    def wiki(self, index):
+        wiki_path = self.path(index)
+        return {
+            "url": self.urls[index],
+            "name": self.names[index],
+            "wiki_path": wiki_path,
+            "links_path": os.path.join(wiki_path, paths.LINKS_DIR),
+            "attachments_path": os.path.join(wiki_path, paths.ATTACHMENTS_DIR),
+        }
+
+    @classmethod
+    def from_nested(cls, communities_tree):
+        # The nested form is {"name", "url", "wikis", "subcomm"} with {"url", "name", "subwiki"} wikis
+        tree = cls()
+        stack = [(COMMUNITY, -1, communities_tree)]
+        while len(stack) > 0:
+            kind, parent, item = stack.pop()
+            index = tree.add(kind, parent, item["url"], item.get("name"))
+            children = [(WIKI, index, wiki) for wiki in item.get("wikis" if kind == COMMUNITY else "subwiki", [])]
+            children.extend((COMMUNITY, index, subcomm) for subcomm in item.get("subcomm", []))
+            stack.extend(reversed(children))
+        return tree
+
+    def dump(self, path):
+        # One line per node, so neither writing nor reading needs another copy of the tree
+        temp = "{}.tmp".format(path)
+        with open(temp, "w") as f:
+            f.write(json.dumps({"version": FORMAT_VERSION, "nodes": len(self)}) + "\n")
+            for i in range(len(self)):
+                f.write(json.dumps([self.kinds[i], self.parents[i], self.urls[i], self.names[i]]) + "\n")
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        tree = cls()
+        with open(path, "r") as f:
+            header = json.loads(f.readline())
+            if not header.get("version") == FORMAT_VERSION:
+                raise ValueError("Unsupported tree format {}".format(header.get("version")))
+            for line in f:
+                kind, parent, url, name = json.loads(line)
+                tree.add(kind, parent, url, name)
+        if not len(tree) == header.get("nodes"):
+            raise ValueError("The tree file is truncated")
+        return tree
@@ -0,0 +1,210 @@
+from w3cpull import downloader as down
+from w3cpull import manifest as mf
+from w3cpull import modifier as mod
+from w3cpull import ratelimit
+from w3cpull import store as st
+from w3cpull import transfer
+from w3cpull import cache
+from w3cpull import paths
+import concurrent.futures
+import logging as log
+import urllib.parse
+import collections
+import os
+
+OK = "ok"
+MISSING = "missing"
+WRONG_SIZE = "wrong_size"
+CORRUPT = "corrupt"
+CHANGED = "changed"
+GONE = "gone"
+UNCHECKED = "unchecked"
+# Fetched again, a file that is gone from the server is only reported
+BAD = (MISSING, WRONG_SIZE, CORRUPT, CHANGED)
+LOG_EVERY = 10000
+
+
+def origin(url):
+    parsed = urllib.parse.urlsplit(url)
+    return "{}://{}/".format(parsed.scheme, parsed.netloc)
+
+
+def changed(entry, headers):
+    # The validators are compared first, the size only when the server sends none
+    etag = headers.get("ETag")
+    if entry["etag"] and etag:
+        return not etag == entry["etag"]
+    last_modified = headers.get("Last-Modified")
+    if entry["last_modified"] and last_modified:
+        return not last_modified == entry["last_modified"]
+    # Pages are rewritten after the download, so their size says nothing
+    length = transfer.content_length(headers)
+    return not entry["kind"] == "page" and length is not None and not entry["size"] == None and not length == entry["size"]
+
+
+class Verifier:
+    # Checks a mirror against its manifest and the server, and fetches only the files that are bad
+    def __init__(self, root, workers=None, segments=None, rate_limit=None, host_rate_limit=None, session_ttl=None, checksum=True, remote=True, repair=True):
+        self.root = os.path.abspath(root)
+        self.workers = int(workers) if not workers == None else transfer.DEFAULT_WORKERS
+        self.segments = int(segments) if not segments == None else transfer.DEFAULT_SEGMENTS
+        self.rate_limit = float(rate_limit) if not rate_limit == None else None
+        self.host_rate_limit = float(host_rate_limit) if not host_rate_limit == None else None
+        self.session_ttl = float(session_ttl) if not session_ttl == None else cache.DEFAULT_SESSION_TTL
+        self.checksum = checksum
+        self.remote = remote
+        self.repair = repair
+
+        self.manifest = None
+        self.engine = None
+        self.origins = set()
+        self.expired = set()
+        self.files = {}
+        self.links = collections.defaultdict(dict)
+        self.counts = collections.Counter()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        # The blobs are left alone, a repaired file replaces its hardlink and not the shared content
+        self.manifest = mf.Manifest(self.root)
+        limiter = ratelimit.RateLimiter(self.rate_limit, self.host_rate_limit, self.workers)
+        self.engine = transfer.ThreadTransfer(self.workers, self.manifest, None, self.segments, limiter)
+        # A session the server no longer accepts is redirected to the sign-in page, which answers with 200
+        self.engine.follow_redirects = False
+
+    def login(self):
+        # The session of the last pull is reused, without one the server would only answer with its login page
+        for url in sorted(set(origin(entries[0]["url"]) for entries in self.files.values())):
+            cookies = cache.load_session(url, self.session_ttl) if self.session_ttl > 0 else None
+            if cookies == None:
+                log.warning("--- No login session for {}, its files are only checked on the disk (pull once to log in)".format(url))
+                continue
+            self.engine.set_cookies(cookies)
+            self.origins.add(url)
+
+    def expire(self, url, e):
+        if not url in self.expired:
+            self.expired.add(url)
+            log.error("--- The login session for {} expired, pull once to log in ({})".format(url, e))
+
+    def load(self):
+        # One check per file, the entry synced last describes it
+        for entry in sorted(self.manifest.entries(), key=lambda entry: entry["synced"] or 0, reverse=True):
+            self.files.setdefault(entry["path"], []).append(entry)
+            if not entry["kind"] == "page":
+                self.links[os.path.dirname(entry["path"])][paths.url_key(entry["url"])] = os.path.basename(entry["path"])
+
+    def check(self, path):
+        entry = self.files[path][0]
+        file = os.path.join(self.root, path)
+        try:
+            size = os.path.getsize(file)
+        except OSError:
+            return MISSING
+        if not entry["size"] == None and not size == entry["size"]:
+            return WRONG_SIZE
+        if self.checksum and entry["sha256"] and not mf.file_sha256(file) == entry["sha256"]:
+            return CORRUPT
+        if not self.remote or not origin(entry["url"]) in self.origins:
+            return OK
+        if entry["kind"] == "page" and not entry["etag"] and not entry["last_modified"]:
+            # Pages saved by the browser have nothing to compare with
+            return OK
+        try:
+            status, headers = self.engine.head(entry["url"])
+        except transfer.RedirectedError as e:
+            self.expire(origin(entry["url"]), e)
+            return UNCHECKED
+        except transfer.ERRORS as e:
+            log.debug("Failed to check {}: {}".format(entry["url"], e))
+            return UNCHECKED
+        if status in (404, 410):
+            return GONE
+        if not status == 200:
+            return UNCHECKED
+        return CHANGED if changed(entry, headers) else OK
+
+    def fetch(self, path):
+        # Returns whether the file was fetched again, the old one stays until the new one is complete
+        entries = self.files[path]
+        entry = entries[0]
+        url = entry["url"]
+        if entry["kind"] == "page":
+            url = down.page_export_url(url)
+            if url == None:
+                log.warning("--- {} can only be downloaded again by a pull".format(path))
+                return False
+        if not origin(url) in self.origins or origin(url) in self.expired:
+            return False
+        file = os.path.join(self.root, path)
+        for old in entries:
+            self.manifest.forget(old["url"], file)
+        try:
+            self.engine.fetch(url, os.path.dirname(file), os.path.basename(file), entry["kind"])
+            if entry["kind"] == "page":
+                links = self.links.get(os.path.join(os.path.dirname(path), paths.LINKS_DIR), {})
+                if mod.replace_links_in_file(file, links):
+                    self.manifest.refresh(file)
+        except transfer.ERRORS as e:
+            if isinstance(e, transfer.RedirectedError):
+                self.expire(origin(url), e)
+            else:
+                log.warning("--- Failed to download {} again: {}".format(path, e))
+            # The file was not replaced, so the entries still describe what it should be
+            for old in entries:
+                self.manifest.record(old["url"], file, old["kind"], old["size"], old["etag"], old["last_modified"], old["sha256"])
+            return False
+        log.info("--- {} downloaded again".format(path))
+        return True
+
+    def run(self):
+        self.load()
+        if self.remote or self.repair:
+            self.login()
+        log.info("--- Checking {} files in the {}".format(len(self.files), self.root))
+
+        bad = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="verify") as executor:
+            for i, (path, state) in enumerate(zip(self.files, executor.map(self.check, self.files)), 1):
+                self.counts[state] += 1
+                if state in BAD:
+                    bad.append(path)
+                if not state in (OK, UNCHECKED):
+                    log.info("--- {} is {}".format(path, state.replace("_", " ")))
+                if i % LOG_EVERY == 0:
+                    log.info("--- {} of {} files checked".format(i, len(self.files)))
+            log.info("--- " + ", ".join("{}: {}".format(state, self.counts[state]) for state in (OK,) + BAD + (GONE, UNCHECKED)))
+
+            if len(self.expired) > 0:
+                # Repairing with the expired session would write the sign-in page over the files
+                log.error("--- The bad files are not downloaded again until a pull logs in")
+                return False
+            if len(bad) == 0 or not self.repair:
+                return len(bad) == 0
+            repaired = sum(executor.map(self.fetch, bad))
+        log.info("--- {} of {} bad files downloaded again".format(repaired, len(bad)))
+        if len(self.expired) > 0:
+            return False
+
+        blobs = os.path.join(self.root, st.BLOBS_NAME)
+        if repaired > 0 and os.path.isdir(blobs):
+            # Blobs that only the replaced files linked to are not needed anymore
+            st.BlobStore(blobs).prune()
+        return repaired == len(bad)
+
+    def close(self):
+        try:
+            if self.engine is not None:
+                self.engine.close()
+        finally:
+            if self.manifest is not None:
+                if not self.manifest.resumed:
+                    # An interrupted pull is left for the next pull to resume
+                    self.manifest.finish()
+                self.manifest.close()
@@ -2,38 +2,83 @@
 W3Cpull
 
 Usage:
-    w3cpull --community-url=COMMUNITY_URL --target-dir=TARGET_DIR_PATH [--temp-dir=TEMP_DIR_PATH] [--w3id-auth=W3ID_AUTH] [--browser=BROWSER] [--recursive] [--visual]
+    w3cpull (--community-url=COMMUNITY_URL | --community-list=FILE) (--target-dir=TARGET_DIR_PATH | --output=ARCHIVE) [--list-concurrency=N] [--temp-dir=TEMP_DIR_PATH] [--w3id-auth=W3ID_AUTH] [--browser=BROWSER] [--browsers=N] [--download-workers=N] [--io-backend=BACKEND] [--segments=N] [--rate-limit=RATE] [--host-rate-limit=RATE] [--incremental] [--no-dedup] [--direct-export] [--download-timeout=SECONDS] [--tree-ttl=SECONDS] [--refresh-tree] [--session-ttl=SECONDS] [--metrics-out=PATH] [--metrics-prom=PATH] [--progress=MODE] [--recursive] [--visual]
+    w3cpull coordinate (--community-url=COMMUNITY_URL | --community-list=FILE) --queue=QUEUE [--serve=ADDRESS] [--temp-dir=TEMP_DIR_PATH] [--w3id-auth=W3ID_AUTH] [--browser=BROWSER] [--browsers=N] [--tree-ttl=SECONDS] [--refresh-tree] [--session-ttl=SECONDS] [--recursive] [--visual]
+    w3cpull work --queue=QUEUE --target-dir=TARGET_DIR_PATH [--lease-ttl=SECONDS] [--temp-dir=TEMP_DIR_PATH] [--w3id-auth=W3ID_AUTH] [--browser=BROWSER] [--browsers=N] [--download-workers=N] [--io-backend=BACKEND] [--segments=N] [--rate-limit=RATE] [--host-rate-limit=RATE] [--no-dedup] [--direct-export] [--download-timeout=SECONDS] [--session-ttl=SECONDS] [--metrics-out=PATH] [--metrics-prom=PATH] [--progress=MODE] [--visual]
+    w3cpull verify --target-dir=TARGET_DIR_PATH [--download-workers=N] [--segments=N] [--rate-limit=RATE] [--host-rate-limit=RATE] [--session-ttl=SECONDS] [--size-only] [--offline] [--dry-run]
     w3cpull -h | --help
     w3cpull -v | --version
 
 Options:
     --community-url=COMMUNITY_URL   Set the URL of the target community
+    --community-list=FILE           Set the path to a file with one community URL per line to pull them all in one session
+    --list-concurrency=N            Set the number of communities from the list that are pulled in parallel (by default, 1)
     --target-dir=TARGET_DIR_PATH    Set the path to the directory where the content will be saved
+    --output=ARCHIVE                Pack the content into an archive as it is downloaded: .zip, .tar, .tar.gz, .tar.bz2, .tar.xz or .tar.zst
     --temp-dir=TEMP_DIR_PATH        Set the path to the folder where the content will be temporarily stored and processed (by default, /tmp)
     --w3id-auth=W3ID_AUTH           Set the uername:password value for automatic authentication
     --browser=BROWSER               Set the name of the browser to use (by default, Firefox)
+    --browsers=N                    Set the number of browsers that crawl and download in parallel (by default, 1)
+    --download-workers=N            Set the number of parallel workers for links and attachments (by default, 8)
+    --io-backend=BACKEND            Set the transfer engine for links and attachments: thread or async (by default, thread)
+    --segments=N                    Set the number of parallel byte ranges for files larger than 64 MB, 1 disables it (by default, 4)
+    --rate-limit=RATE               Set the maximum number of requests per second for all hosts together (by default, unlimited)
+    --host-rate-limit=RATE          Set the maximum number of requests per second for every host (by default, unlimited)
+    --incremental                   Save the content directly into the target directory and download only what changed since the previous run
+    --no-dedup                      Save every copy of a file separately instead of hardlinking identical content
+    --direct-export                 Fetch wiki pages and attachment lists over HTTP with the browser session, the browser only opens pages that cannot be fetched
+    --download-timeout=SECONDS      Set how long to wait for the browser to finish a page download (by default, 300)
+    --tree-ttl=SECONDS              Set how long a scanned community structure is reused from the cache (by default, 86400)
+    --refresh-tree                  Scan the community structure again even if a cached one is still valid
+    --session-ttl=SECONDS           Set how long the login session is reused by the next runs, 0 to disable (by default, 28800)
+    --queue=QUEUE                   Set the work queue of a distributed crawl: an SQLite file or the http://HOST:PORT of a coordinator
+    --serve=ADDRESS                 Serve the queue to the workers on other nodes at HOST:PORT
+    --lease-ttl=SECONDS             Set how long a worker holds its units before they are given to another worker (by default, 600)
+    --metrics-out=PATH              Write per-phase timings and per-wiki transfer counters to a JSON file
+    --metrics-prom=PATH             Write the same metrics in the Prometheus textfile format
+    --progress=MODE                 Show the progress with the throughput and ETA: bar (on the standard error) or json (events on the standard output)
+    --size-only                     Check the files of a mirror by their size only, without reading them to compare the hashes
+    --offline                       Check the files of a mirror on the disk only, without asking the server whether they changed
+    --dry-run                       Only report the bad files of a mirror, without downloading them again
     --recursive                     Set the recursive execution type (with subcommunity processing)
     --visual                        Set the visual execution type (with the browser open)
     -h, --help                      Show this help message.
     -v, --version                   Show the version.
 '''
 
-from schema import Schema, And, Or, Use, Optional, Regex, SchemaError
-from w3cpull import downloader as down
-from w3cpull import modifier as mod
+from w3cpull import archive as ar
+from w3cpull import cache
 from docopt import docopt
 import logging as log
 import datetime
+import threading
 import hashlib
 import shutil
+import socket
 import time
 import json
 import sys
+import re
 import os
 
 SELENIUM_DEFAULT_DIR = '/tmp'
+COMMUNITY_URL_PATTERN = r'^https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?!&//=]*)$'
 CONTENT_DIR = None
 COMPLETED_STATUS = None
+COORDINATOR_POLL = 30
+WORKER_POLL = 5
+ATTACHMENTS_BATCH = 50
+
+# Selenium, requests and the transfer engines take most of the startup, they are imported when needed
+down = None
+mf = None
+mt = None
+st = None
+transfer = None
+watcher = None
+wq = None
+pg = None
+vf = None
 
 log.basicConfig(
     stream=sys.stdout,
@@ -42,9 +87,9 @@ log.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-def hash_path(location):
+def hash_path(location, root=None):
     return os.path.join(
-        os.path.abspath(SELENIUM_DEFAULT_DIR),
+        os.path.abspath(root if not root == None else SELENIUM_DEFAULT_DIR),
         hashlib.md5(
             (
                 "{0}_{1}".format(
@@ -58,11 +103,38 @@ def hash_path(location):
         ).hexdigest()
     )
 
+def load():
+    global down, mf, mt, st, transfer, watcher, wq, pg, vf
+    if down is None:
+        from w3cpull import downloader as down
+        from w3cpull import manifest as mf
+        from w3cpull import metrics as mt
+        from w3cpull import progress as pg
+        from w3cpull import store as st
+        from w3cpull import transfer
+        from w3cpull import verify as vf
+        from w3cpull import watcher
+        from w3cpull import workqueue as wq
+
+def expand_path(path):
+    return (os.path.abspath(path) if not path[0] == '~' else os.path.expanduser(path))
+
 def validate_args(args):
+    from schema import Schema, And, Or, Use, Regex, SchemaError
+
     schema = Schema({
         '--community-url': Or(None,
-            Regex(r'^https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?!&//=]*)$'),
+            Regex(COMMUNITY_URL_PATTERN),
             error='The URL has an incorrect format'),
+        '--output': Or(None,
+            And(str, ar.supported, lambda p: os.path.isdir(os.path.dirname(os.path.abspath(os.path.expanduser(p))))),
+            error='The archive must be a .zip, .tar, .tar.gz, .tar.bz2, .tar.xz or .tar.zst file in an existing directory'),
+        '--community-list': Or(None,
+            And(str, lambda p: os.path.isfile(os.path.expanduser(p))),
+            error='The community list file does not exist'),
+        '--list-concurrency': Or(None,
+            And(Use(int), lambda n: n > 0),
+            error='The list concurrency must be a positive integer'),
         '--target-dir': Or(None,
             Use(lambda d: (os.path.exists(d) and os.listdir(d)) or (os.path.exists(os.path.expanduser(d)) and os.listdir(os.path.expanduser(d)))),
             error = 'The target path does not exist or cannot be accessed'),
@@ -75,8 +147,63 @@ def validate_args(args):
         '--browser': Or(None,
             Regex(r'^((C|c)hrome|(F|f)irefox)$'),
             error='Specified browser not supported. Use Chrome or Firefox'),
+        '--browsers': Or(None,
+            And(Use(int), lambda n: n > 0),
+            error='The number of browsers must be a positive integer'),
+        '--download-workers': Or(None,
+            And(Use(int), lambda n: n > 0),
+            error='The number of download workers must be a positive integer'),
+        '--io-backend': Or(None,
+            Regex(r'^(thread|async)$'),
+            error='Specified I/O backend not supported. Use thread or async'),
+        '--download-timeout': Or(None,
+            And(Use(float), lambda n: n > 0),
+            error='The download timeout must be a positive number of seconds'),
+        '--segments': Or(None,
+            And(Use(int), lambda n: n > 0),
+            error='The number of segments must be a positive integer'),
+        '--rate-limit': Or(None,
+            And(Use(float), lambda n: n > 0),
+            error='The rate limit must be a positive number of requests per second'),
+        '--host-rate-limit': Or(None,
+            And(Use(float), lambda n: n > 0),
+            error='The host rate limit must be a positive number of requests per second'),
+        '--tree-ttl': Or(None,
+            And(Use(float), lambda n: n >= 0),
+            error='The tree TTL must be a non-negative number of seconds'),
+        '--session-ttl': Or(None,
+            And(Use(float), lambda n: n >= 0),
+            error='The session TTL must be a non-negative number of seconds'),
+        '--metrics-out': Or(None,
+            And(str, lambda p: os.path.isdir(os.path.dirname(os.path.abspath(os.path.expanduser(p))))),
+            error='The directory for the metrics file does not exist'),
+        '--metrics-prom': Or(None,
+            And(str, lambda p: os.path.isdir(os.path.dirname(os.path.abspath(os.path.expanduser(p))))),
+            error='The directory for the Prometheus metrics file does not exist'),
+        '--queue': Or(None,
+            And(str, lambda q: q.startswith(('http://', 'https://')) or os.path.isdir(os.path.dirname(os.path.abspath(os.path.expanduser(q))))),
+            error='The work queue must be an http:// URL or a file in an existing directory'),
+        '--serve': Or(None,
+            Regex(r'^[^:]*:\d+$'),
+            error='The queue address must be in the HOST:PORT format'),
+        '--lease-ttl': Or(None,
+            And(Use(float), lambda n: n > 0),
+            error='The lease TTL must be a positive number of seconds'),
+        '--progress': Or(None,
+            Regex(r'^(bar|json)$'),
+            error='Specified progress display not supported. Use bar or json'),
+        '--refresh-tree': Or(True, False),
+        '--incremental': Or(True, False),
+        '--no-dedup': Or(True, False),
+        '--direct-export': Or(True, False),
         '--recursive': Or(True, False),
         '--visual': Or(True, False),
+        '--size-only': Or(True, False),
+        '--offline': Or(True, False),
+        '--dry-run': Or(True, False),
+        'coordinate': Or(True, False),
+        'work': Or(True, False),
+        'verify': Or(True, False),
         '--help': Or(True, False),
         '--version': Or(True, False)
     })
@@ -84,9 +211,31 @@ def validate_args(args):
     try:
         schema.validate(args)
         if not args['--community-url'] == None:
+            load()
             if not down.check_if_url_accessible(args['--community-url']):
                 log.error('The community URL does not exist or is unavailable')
                 return False
+        if args['verify']:
+            load()
+            if not os.path.isfile(os.path.join(expand_path(args['--target-dir']), mf.MANIFEST_NAME)):
+                log.error('The target directory has no manifest, only a mirror pulled with --incremental can be verified')
+                return False
+            return True
+        if not args['--serve'] == None and args['--queue'].startswith(('http://', 'https://')):
+            log.error('Only a local queue file can be served to the workers')
+            return False
+        if not args['--output'] == None and args['--incremental']:
+            log.error('The incremental synchronization needs a target directory, it cannot write an archive')
+            return False
+        if not args['--community-list'] == None:
+            community_urls = read_community_list(args['--community-list'])
+            if len(community_urls) == 0:
+                log.error('The community list is empty')
+                return False
+            for community_url in community_urls:
+                if re.match(COMMUNITY_URL_PATTERN, community_url) is None:
+                    log.error('The URL {} in the community list has an incorrect format'.format(community_url))
+                    return False
         if not args['--visual']:
             if args['--w3id-auth'] == None:
                 log.error('If you want to launch the app without opening the browser you must provide the w3id credentials')
@@ -97,83 +246,530 @@ def validate_args(args):
 
     return True
 
-def download(community_url, target_dir, temp_dir, w3id_auth, recursive, visual, browser):
-    global COMPLETED_STATUS
-    global CONTENT_DIR
-    global TEMP_TARGET_DIR
-    global TEMP_DOWNLOAD_DIR
+class Puller:
+    # Keeps one set of browsers, one login and one transfer pool for any number of communities
+    def __init__(self, target_dir, temp_dir=None, w3id_auth=None, recursive=False, visual=False, browser=None, download_workers=None, io_backend=None, incremental=False, direct_export=False, download_timeout=None, browsers=None, dedup=True, tree_ttl=None, refresh_tree=False, segments=None, rate_limit=None, host_rate_limit=None, metrics_out=None, metrics_prom=None, list_concurrency=None, output=None, session_ttl=None, progress=None):
+        load()
+        self.target_dir = target_dir
+        self.temp_dir = temp_dir if not temp_dir == None else SELENIUM_DEFAULT_DIR
+        self.w3id_login = None
+        self.w3id_password = None
+        if not w3id_auth == None:
+            self.w3id_login, self.w3id_password = w3id_auth.split(':', 1)
+        self.recursive = recursive
+        self.visual = visual
+        self.browser = browser
+        self.download_workers = int(download_workers) if not download_workers == None else transfer.DEFAULT_WORKERS
+        self.io_backend = io_backend if not io_backend == None else transfer.DEFAULT_BACKEND
+        self.incremental = incremental
+        self.direct_export = direct_export
+        self.download_timeout = float(download_timeout) if not download_timeout == None else watcher.DEFAULT_TIMEOUT
+        self.browsers = int(browsers) if not browsers == None else 1
+        self.dedup = dedup
+        self.tree_ttl = float(tree_ttl) if not tree_ttl == None else cache.DEFAULT_TREE_TTL
+        self.refresh_tree = refresh_tree
+        self.segments = int(segments) if not segments == None else transfer.DEFAULT_SEGMENTS
+        self.rate_limit = float(rate_limit) if not rate_limit == None else None
+        self.host_rate_limit = float(host_rate_limit) if not host_rate_limit == None else None
+        self.metrics_out = metrics_out
+        self.metrics_prom = metrics_prom
+        self.list_concurrency = int(list_concurrency) if not list_concurrency == None else 1
+        self.output = output
+        # Workers of a distributed crawl write straight into the target directory
+        self.in_place = incremental
+        # and share it with the other workers
+        self.shared = False
+        self.session_ttl = float(session_ttl) if not session_ttl == None else cache.DEFAULT_SESSION_TTL
+        self.progress_mode = progress
 
-    COMPLETED_STATUS = False
+        self.downloader = None
+        self.driver = None
+        self.groups = []
+        self.logged_in = False
+        self.session_url = None
+        self.manifest = None
+        self.store = None
+        self.metrics = None
+        self.progress = None
+        self.archive = None
+        self.completed = True
+        self.interrupted = False
+        self.content_dirs = {}
 
-    content_dir = None
+    def __enter__(self):
+        self.open()
+        return self
 
-    w3id_login = None
-    w3id_password = None
+    def __exit__(self, *exc):
+        self.interrupted = not exc[0] == None
+        self.close()
 
-    if not w3id_auth == None:
-        w3id_login, w3id_password = w3id_auth.split(':', 1)
+    def open(self):
+        self.temp_download_dir = os.path.abspath(hash_path('TEMP_DOWNLOAD_DIR', self.temp_dir))
+        self.temp_target_dir = os.path.abspath(hash_path('TARGET_DIR', self.temp_dir))
 
-    TEMP_DOWNLOAD_DIR = os.path.abspath(hash_path('TEMP_DOWNLOAD_DIR'))
-    TEMP_TARGET_DIR = os.path.abspath(hash_path('TARGET_DIR'))
+        if self.in_place:
+            # The content is synced in place, so an interrupted run keeps its progress
+            self.temp_target_dir = expand_path(self.target_dir)
+        if self.incremental:
+            self.manifest = mf.Manifest(self.temp_target_dir)
+            if self.manifest.resumed:
+                log.info("Resuming the interrupted synchronization in the {}".format(self.temp_target_dir))
 
-    MODULE_DIR = down.__file__.rsplit('/', 1)[0]
+        if self.dedup:
+            # Hardlinks only work within one file system, so the blobs are kept next to the content
+            blobs = hash_path('BLOB_DIR', self.temp_dir)
+            if self.shared:
+                # Every worker removes its store when it is done, so it cannot share one with the others
+                blobs = os.path.join(
+                    self.temp_target_dir, "{}-{}-{}".format(st.BLOBS_NAME, socket.gethostname(), os.getpid())
+                )
+            elif self.in_place:
+                blobs = os.path.join(self.temp_target_dir, st.BLOBS_NAME)
+            self.store = st.BlobStore(blobs)
 
-    driver = down.init(MODULE_DIR, TEMP_TARGET_DIR, TEMP_DOWNLOAD_DIR, visual, browser)
-    driver.implicitly_wait(10)
+        # Workers read the errors of their units from the same counters
+        if not self.metrics_out == None or not self.metrics_prom == None or not self.progress_mode == None or self.shared:
+            self.metrics = mt.Metrics()
+            self.metrics.root = self.temp_target_dir
+        if not self.progress_mode == None:
+            # The progress is read from the same counters as the metrics
+            self.progress = pg.Progress(self.metrics, self.progress_mode)
+            self.progress.start()
+
+        if not self.output == None:
+            # Only the files that are still being downloaded or rewritten are on the disk
+            self.archive = ar.Archive(expand_path(self.output), self.temp_target_dir)
+
+        MODULE_DIR = down.__file__.rsplit('/', 1)[0]
+
+        self.downloader = down.init(
+            MODULE_DIR, self.temp_target_dir, self.temp_download_dir, self.visual, self.browser,
+            self.download_workers,
+            self.io_backend,
+            self.manifest,
+            self.direct_export,
+            self.download_timeout,
+            max(self.browsers, self.list_concurrency),
+            self.store,
+            self.segments,
+            self.rate_limit,
+            self.host_rate_limit,
+            self.metrics,
+            self.archive
+        )
+        self.driver = self.downloader.driver
+        self.driver.implicitly_wait(10)
+
+        # Communities of a list are pulled in parallel by groups of browsers, the first one of a group scans
+        drivers = [(self.driver, self.temp_download_dir)] + self.downloader.browsers
+        self.groups = [drivers[i::self.list_concurrency] for i in range(self.list_concurrency)]
+
+    def login(self, community_url):
+        # Only the first community goes through w3id, the other browsers get a copy of the session
+        if self.logged_in:
+            return
+        if self.session_ttl > 0:
+            # A fresh session from the last run skips the w3id pages, an expired one ends up there anyway
+            cookies = cache.load_session(community_url, self.session_ttl)
+            if not cookies == None:
+                log.info("--- Restoring the session of the last run (use --session-ttl=0 to log in again)")
+                down.add_cookies(self.driver, community_url, cookies)
+        down.login(self.driver, community_url, self.w3id_login, self.w3id_password)
+        if self.session_ttl > 0:
+            cache.save_session(community_url, self.driver.get_cookies())
+        self.session_url = community_url
+        self.downloader.share_session(self.driver)
+        self.logged_in = True
+
+    def scan(self, community_url, driver, pool):
+        with self.downloader.phase("tree_scan"):
+            communities_tree = None
+            if not self.refresh_tree:
+                communities_tree = cache.load_tree(community_url, self.recursive, self.tree_ttl)
+            if communities_tree == None:
+                communities_tree = self.downloader.create_communities_tree(
+                    driver, community_url, self.recursive, self.w3id_login, self.w3id_password, pool
+                )
+                cache.save_tree(community_url, self.recursive, communities_tree)
+            else:
+                log.info("--- Using the cached structure tree (use --refresh-tree to scan again)")
+        return communities_tree
+
+    def pull(self, community_url, group=None):
+        group = self.groups[0] if group is None else group
+        driver, download_dir = group[0]
+        pool = group[1:]
+
+        self.login(community_url)
 
-    try:
         log.info("Step 1/3 : Scanning the community and building the structure tree")
-        communities_tree = down.create_communities_tree(driver, community_url, recursive, w3id_login, w3id_password)
+        communities_tree = self.scan(community_url, driver, pool)
 
         log.info("Step 2/3 : Creating a structure tree in the file system")
-        communities_fs_mapping = down.create_fs_tree(TEMP_TARGET_DIR, communities_tree)
+        with self.downloader.phase("create_fs_tree"):
+            communities_tree = self.downloader.create_fs_tree(self.temp_target_dir, communities_tree)
+        if self.progress is not None:
+            with self.downloader.phase("plan"):
+                self.progress.plan(**self.downloader.plan_work(communities_tree))
 
         log.info("Step 3/3 : Downloading community content")
-        down.download_community(driver, communities_fs_mapping, TEMP_DOWNLOAD_DIR)
-        mod.replace_links(TEMP_TARGET_DIR)
+        self.downloader.download_community(driver, communities_tree, download_dir, pool)
+
+        with self.downloader.phase("move_to_target"):
+            content_dir = communities_tree.path(0)
+            if self.archive is not None:
+                content_dir = self.archive.path
+            elif not self.incremental and not self.target_dir == None:
+                try:
+                    content_dir = shutil.move(content_dir, expand_path(self.target_dir))
+                except shutil.Error as e:
+                    log.warning(e)
+            log.info("--- The structure and content of the community now in the {}".format(content_dir))
+
+        self.content_dirs[community_url] = content_dir
+        return content_dir
 
-        if not target_dir == None:
-            target_dir = (os.path.abspath(target_dir) if not target_dir[0] == '~' else os.path.expanduser(target_dir))
+    def pull_all(self, community_urls):
+        # One failed community does not stop the rest of the list
+        def pull(group, community_url):
             try:
-                content_dir = down.move_content(TEMP_TARGET_DIR, target_dir)[0]
-                log.info("--- The structure and content of the community now in the {}".format(content_dir))
-                shutil.rmtree(TEMP_TARGET_DIR)
-            except shutil.Error as e:
-                log.warning(e)
-                log.info("--- The structure and content of the community now in the {}".format(TEMP_TARGET_DIR))
+                self.pull(community_url, group)
+            except Exception as e:
+                log.error("--- {} failed: {}".format(community_url, e))
+                self.completed = False
+
+        if len(community_urls) == 0:
+            return self.completed
+        self.login(community_urls[0])
+        if len(self.groups) > 1:
+            down.run_in_pool(self.groups, community_urls, pull)
         else:
-            content_dir = os.path.join(os.path.abspath(TEMP_TARGET_DIR), os.listdir(os.path.abspath(TEMP_TARGET_DIR))[0])
+            for community_url in community_urls:
+                pull(self.groups[0], community_url)
+        return self.completed
 
-        COMPLETED_STATUS = True
-    finally:
-        down.finish(driver)
+    def enqueue(self, community_url, work_queue):
+        # The paths are planned here once, the workers only join them to their own target directory
+        group = self.groups[0]
+        communities_tree = self.scan(community_url, group[0][0], group[1:])
+        self.downloader.create_fs_tree(self.temp_target_dir, communities_tree, False)
+        units = []
+        for wiki in down.flatten_wikis(communities_tree):
+            payload = {"community": community_url, "url": wiki["url"], "name": wiki["name"]}
+            for key in ("wiki_path", "links_path", "attachments_path"):
+                payload[key] = os.path.relpath(wiki[key], self.temp_target_dir)
+            units.append(("wiki|{}".format(wiki["url"]), "wiki", payload))
+        added = work_queue.put_all(units)
+        log.info("--- {} wikis of {} queued ({} already in the queue)".format(added, community_url, len(units) - added))
+
+    def coordinate(self, community_urls, work_queue):
+        work_queue.seal(False)
+        if len(community_urls) > 0:
+            self.login(community_urls[0])
+        for community_url in community_urls:
+            try:
+                self.enqueue(community_url, work_queue)
+            except Exception as e:
+                log.error("--- {} failed: {}".format(community_url, e))
+                self.completed = False
+        work_queue.seal()
+
+        # The coordinator reports the outcome of the whole crawl, so it waits for the workers
+        while True:
+            counts = work_queue.counts()
+            if counts.get("queued", 0) + counts.get("leased", 0) == 0:
+                break
+            log.info("--- Queued: {}, leased: {}, done: {}, failed: {}".format(
+                counts.get("queued", 0), counts.get("leased", 0), counts.get("done", 0), counts.get("failed", 0)
+            ))
+            time.sleep(COORDINATOR_POLL)
+        if counts.get("failed", 0) > 0:
+            log.error("--- {} units failed on every attempt".format(counts["failed"]))
+            self.completed = False
+        return self.completed
+
+    def queue_attachments(self, work_queue, urls, path):
+        # The first batch is fetched here, the rest goes to whichever worker is free. The names are
+        # planned here for the whole list, each worker only knows the batches it runs
+        names = self.downloader.paths.propose(urls, path)
+        self.downloader.transfer.submit_all(urls[:ATTACHMENTS_BATCH], path, names[:ATTACHMENTS_BATCH])
+        path = os.path.relpath(path, self.temp_target_dir)
+        work_queue.put_all([
+            ("attachments|{}|{}".format(path, i), "attachments", {
+                "community": self.session_url, "path": path,
+                "urls": urls[i:i + ATTACHMENTS_BATCH], "names": names[i:i + ATTACHMENTS_BATCH]
+            })
+            for i in range(ATTACHMENTS_BATCH, len(urls), ATTACHMENTS_BATCH)
+        ])
+
+    def run_unit(self, driver, download_dir, unit):
+        payload = unit["payload"]
+        if unit["kind"] == "attachments":
+            path = os.path.join(self.temp_target_dir, payload["path"])
+            os.makedirs(path, exist_ok=True)
+            self.downloader.transfer.submit_all(payload["urls"], path, payload.get("names"))
+            return
+        wiki = dict(payload)
+        for key in ("wiki_path", "links_path", "attachments_path"):
+            wiki[key] = os.path.join(self.temp_target_dir, payload[key])
+        os.makedirs(wiki["links_path"], exist_ok=True)
+        os.makedirs(wiki["attachments_path"], exist_ok=True)
+        self.downloader.download_wiki_page(driver, wiki, download_dir)
+
+    def unit_wiki(self, unit):
+        # The directory the transfer errors of a unit are counted for
+        payload = unit["payload"]
+        if unit["kind"] == "attachments":
+            return os.path.abspath(os.path.dirname(os.path.join(self.temp_target_dir, payload["path"])))
+        return os.path.abspath(os.path.join(self.temp_target_dir, payload["wiki_path"]))
+
+    def work(self, work_queue, lease_ttl=None):
+        # A batch is reported done only once its files are written, a worker that dies leaves it to the others
+        lease_ttl = float(lease_ttl) if not lease_ttl == None else wq.DEFAULT_LEASE
+        worker = "{}:{}".format(socket.gethostname(), os.getpid())
+        download_dirs = dict([(self.driver, self.temp_download_dir)] + self.downloader.browsers)
+        self.downloader.attachments_handler = lambda urls, path: self.queue_attachments(work_queue, urls, path)
+
+        while True:
+            units = work_queue.lease(worker, len(download_dirs), lease_ttl)
+            if len(units) == 0:
+                counts = work_queue.counts()
+                if counts["sealed"] and counts.get("queued", 0) + counts.get("leased", 0) == 0:
+                    break
+                time.sleep(WORKER_POLL)
+                continue
+            if not self.logged_in:
+                self.login(units[0]["payload"]["community"])
+                if self.downloader.direct_export:
+                    self.downloader.share_cookies(self.driver)
+
+            failed = {}
+            errors = {unit["id"]: self.metrics.get(self.unit_wiki(unit), "errors") for unit in units}
+            renewed = threading.Event()
+
+            def renew():
+                while not renewed.wait(lease_ttl / 3):
+                    try:
+                        work_queue.renew(worker, [unit["id"] for unit in units], lease_ttl)
+                    except Exception as e:
+                        log.warning("Failed to renew the lease: {}".format(e))
 
-    CONTENT_DIR = content_dir
+            def run(driver, unit):
+                try:
+                    self.run_unit(driver, download_dirs[driver], unit)
+                except Exception as e:
+                    log.error("--- Unit {} failed: {}".format(unit["id"], e))
+                    failed[unit["id"]] = e
+
+            heartbeat = threading.Thread(target=renew, name="lease", daemon=True)
+            heartbeat.start()
+            try:
+                down.run_in_pool(list(download_dirs), units, run)
+                self.downloader.drain()
+            finally:
+                renewed.set()
+                heartbeat.join()
+            # The transfers only log the files that failed, a unit with any of them is given back to the queue
+            for unit in units:
+                count = self.metrics.get(self.unit_wiki(unit), "errors") - errors[unit["id"]]
+                if count > 0 and not unit["id"] in failed:
+                    log.error("--- Unit {} failed: {} files could not be downloaded".format(unit["id"], count))
+                    failed[unit["id"]] = "{} files could not be downloaded".format(count)
+            for id, e in failed.items():
+                work_queue.fail(worker, id, e)
+            work_queue.done(worker, [unit["id"] for unit in units if not unit["id"] in failed])
+        return self.completed
+
+    def close(self):
+        try:
+            if self.incremental and not self.interrupted:
+                # A run that ended with failed communities is finished too, only an interrupted one is continued
+                if self.completed and self.store is not None:
+                    self.store.prune()
+                self.manifest.finish()
+        finally:
+            if self.downloader is not None:
+                self.downloader.finish()
+            if self.archive is not None:
+                self.archive.close(self.completed)
+                shutil.rmtree(self.temp_target_dir, ignore_errors=True)
+            if self.manifest is not None:
+                self.manifest.close()
+            if self.store is not None and not self.incremental:
+                shutil.rmtree(self.store.root, ignore_errors=True)
+            if not self.in_place and os.path.isdir(self.temp_target_dir) and not os.listdir(self.temp_target_dir):
+                # Whatever could not be moved to the target stays here
+                os.rmdir(self.temp_target_dir)
+            shutil.rmtree(self.temp_download_dir, ignore_errors=True)
+            if self.progress is not None:
+                self.progress.close()
+            if self.metrics is not None:
+                if not self.metrics_out == None:
+                    self.metrics.write_json(os.path.expanduser(self.metrics_out), completed=self.completed)
+                if not self.metrics_prom == None:
+                    self.metrics.write_prometheus(os.path.expanduser(self.metrics_prom), completed=self.completed)
+
+
+def download(community_url, target_dir, temp_dir, w3id_auth, recursive, visual, browser, download_workers=None, io_backend=None, incremental=False, direct_export=False, download_timeout=None, browsers=None, dedup=True, tree_ttl=None, refresh_tree=False, segments=None, rate_limit=None, host_rate_limit=None, metrics_out=None, metrics_prom=None, output=None, session_ttl=None):
+    global COMPLETED_STATUS
+    global CONTENT_DIR
+
+    COMPLETED_STATUS = False
+    CONTENT_DIR = None
+
+    puller = Puller(
+        target_dir, temp_dir, w3id_auth, recursive, visual, browser, download_workers, io_backend, incremental,
+        direct_export, download_timeout, browsers, dedup, tree_ttl, refresh_tree, segments, rate_limit,
+        host_rate_limit, metrics_out, metrics_prom, None, output, session_ttl
+    )
+    with puller:
+        puller.completed = False
+        CONTENT_DIR = puller.pull(community_url)
+        puller.completed = True
+    COMPLETED_STATUS = puller.completed
 
     return COMPLETED_STATUS
 
 
+def read_community_list(path):
+    # One URL per line, blank lines and comments are skipped
+    with open(os.path.expanduser(path), "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+def pull(args, community_urls):
+    puller = Puller(
+        args['--target-dir'],
+        args['--temp-dir'],
+        args['--w3id-auth'],
+        args['--recursive'],
+        args['--visual'],
+        args['--browser'],
+        args['--download-workers'],
+        args['--io-backend'],
+        args['--incremental'],
+        args['--direct-export'],
+        args['--download-timeout'],
+        args['--browsers'],
+        not args['--no-dedup'],
+        args['--tree-ttl'],
+        args['--refresh-tree'],
+        args['--segments'],
+        args['--rate-limit'],
+        args['--host-rate-limit'],
+        args['--metrics-out'],
+        args['--metrics-prom'],
+        args['--list-concurrency'],
+        args['--output'],
+        args['--session-ttl']
+    )
+    with puller:
+        return puller.pull_all(community_urls)
+
+
+def coordinate(args, community_urls):
+    puller = Puller(
+        None,
+        args['--temp-dir'],
+        args['--w3id-auth'],
+        args['--recursive'],
+        args['--visual'],
+        args['--browser'],
+        browsers=args['--browsers'],
+        dedup=False,
+        tree_ttl=args['--tree-ttl'],
+        refresh_tree=args['--refresh-tree'],
+        session_ttl=args['--session-ttl']
+    )
+    work_queue = wq.open_queue(args['--queue'])
+    server = None
+    try:
+        if not args['--serve'] == None:
+            server = wq.QueueServer(work_queue, args['--serve'])
+            log.info("--- Serving the work queue at http://{}".format(args['--serve']))
+        with puller:
+            return puller.coordinate(community_urls, work_queue)
+    finally:
+        if server is not None:
+            server.close()
+        work_queue.close()
+
+
+def work(args):
+    puller = Puller(
+        args['--target-dir'],
+        args['--temp-dir'],
+        args['--w3id-auth'],
+        False,
+        args['--visual'],
+        args['--browser'],
+        args['--download-workers'],
+        args['--io-backend'],
+        direct_export=args['--direct-export'],
+        download_timeout=args['--download-timeout'],
+        browsers=args['--browsers'],
+        dedup=not args['--no-dedup'],
+        segments=args['--segments'],
+        rate_limit=args['--rate-limit'],
+        host_rate_limit=args['--host-rate-limit'],
+        metrics_out=args['--metrics-out'],
+        metrics_prom=args['--metrics-prom'],
+        session_ttl=args['--session-ttl'],
+        progress=args['--progress']
+    )
+    puller.in_place = True
+    puller.shared = True
+    work_queue = wq.open_queue(args['--queue'])
+    try:
+        with puller:
+            return puller.work(work_queue, args['--lease-ttl'])
+    finally:
+        work_queue.close()
+
+
+def verify(args):
+    verifier = vf.Verifier(
+        expand_path(args['--target-dir']),
+        args['--download-workers'],
+        args['--segments'],
+        args['--rate-limit'],
+        args['--host-rate-limit'],
+        args['--session-ttl'],
+        checksum=not args['--size-only'],
+        remote=not args['--offline'],
+        repair=not args['--dry-run']
+    )
+    with verifier:
+        return verifier.run()
+
+
 def main():
     args = docopt(__doc__, version='1.1.0')
+    if args['--progress'] == 'json':
+        # The standard output is left to the progress events
+        for handler in log.getLogger().handlers:
+            handler.setStream(sys.stderr)
 
     if validate_args(args):
         if not args['--temp-dir'] == None:
             SELENIUM_DEFAULT_DIR = args['--temp-dir']
 
+        community_urls = (
+            [args['--community-url']] if args['--community-list'] == None else read_community_list(args['--community-list'])
+        ) if not args['work'] and not args['verify'] else []
+
         start_time = time.time()
-        COMPLETED_STATUS = download(
-            args['--community-url'],
-            args['--target-dir'],
-            args['--temp-dir'],
-            args['--w3id-auth'],
-            args['--recursive'],
-            args['--visual'],
-            args['--browser']
-        )
+        if args['coordinate']:
+            COMPLETED_STATUS = coordinate(args, community_urls)
+        elif args['work']:
+            COMPLETED_STATUS = work(args)
+        elif args['verify']:
+            COMPLETED_STATUS = verify(args)
+        else:
+            COMPLETED_STATUS = pull(args, community_urls)
         finish_time = time.time()
 
-        shutil.rmtree(TEMP_DOWNLOAD_DIR)
-
         log.info("EXECUTION TIME: {0}, COMPLETED SUCCESSFULLY: {1}".format(str(datetime.timedelta(seconds=finish_time-start_time)), COMPLETED_STATUS))
         if not COMPLETED_STATUS:
             log.info('''
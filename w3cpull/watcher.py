@@ -0,0 +1,170 @@
+import ctypes.util
+import collections
+import platform
+import ctypes
+import select
+import shutil
+import time
+import os
+import re
+
+# Chrome, Firefox and Safari in-progress download suffixes
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".download")
+DEFAULT_TIMEOUT = 300
+POLL_INTERVAL = 0.2
+ABANDONED_MAX = 16
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class Inotify:
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        # The events only wake the watcher up, the directory is rescanned anyway
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    def wait(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+    def close(self):
+        pass
+
+
+def notifier(path):
+    if platform.system() == "Linux":
+        try:
+            return Inotify(path)
+        except (OSError, AttributeError):
+            pass
+    return Poller()
+
+
+def normalize(name):
+    return re.sub(r"[\W_]+", "", name).lower()
+
+
+class DownloadWatcher:
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        self.path = os.path.abspath(path)
+        self.timeout = timeout
+        self.notifier = notifier(self.path)
+        self.before = set()
+        self.abandoned = collections.deque(maxlen=ABANDONED_MAX)
+
+    def expect(self):
+        # Called before the download is started, whatever is in the directory by then belongs to another page
+        self.before = set(os.listdir(self.path))
+
+    def scan(self):
+        names = os.listdir(self.path)
+        partial = set()
+        for name in names:
+            for suffix in PARTIAL_SUFFIXES:
+                if name.endswith(suffix):
+                    partial.add(name[:-len(suffix)])
+        # Firefox creates an empty placeholder next to the .part file, and for a moment before it, skip it too
+        files = [
+            name for name in names
+            if not name.endswith(PARTIAL_SUFFIXES) and not name in partial and not name.startswith(".")
+            and not name in self.before and self.size(name) > 0
+        ]
+        for hint in list(self.abandoned):
+            # A page that timed out may still arrive, it must not be taken for the next one
+            name = next((name for name in files if normalize(os.path.splitext(name)[0]) == normalize(hint)), None)
+            if name is not None:
+                self.remove(name)
+                files.remove(name)
+                self.abandoned.remove(hint)
+        files.sort(key=self.mtime)
+        return files, len(partial)
+
+    def mtime(self, name):
+        # The browser may rename the file between listing and stat
+        try:
+            return os.path.getmtime(os.path.join(self.path, name))
+        except OSError:
+            return 0
+
+    def size(self, name):
+        try:
+            return os.path.getsize(os.path.join(self.path, name))
+        except OSError:
+            return 0
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def match(self, files, hint):
+        if hint is None:
+            return files[0] if len(files) > 0 else None
+        hint = normalize(hint)
+        for name in files:
+            stem = normalize(os.path.splitext(name)[0])
+            if len(stem) > 0 and (stem.startswith(hint) or hint.startswith(stem)):
+                return name
+        return None
+
+    def wait_for(self, hint=None, timeout=None):
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        if hint in self.abandoned:
+            # The same page is downloaded again, so a late copy is welcome now
+            self.abandoned.remove(hint)
+        while True:
+            files, in_progress = self.scan()
+            name = self.match(files, hint)
+            if name is None and hint is not None and len(files) == 1 and in_progress == 0:
+                # Nothing else is in flight, so a single new finished file belongs to this page
+                name = files[0]
+            if name is not None:
+                return os.path.join(self.path, name)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                for name in files:
+                    self.remove(name)
+                if hint is not None:
+                    self.abandoned.append(hint)
+                raise TimeoutError("No download finished in {} within {} s".format(self.path, self.timeout))
+            self.notifier.wait(remaining)
+
+    def collect(self, dst, hint=None, timeout=None):
+        return move(self.wait_for(hint, timeout), dst)
+
+    def close(self):
+        self.notifier.close()
+
+
+def move(src, dst):
+    target = os.path.join(os.path.abspath(dst), os.path.basename(src))
+    if os.path.isfile(target):
+        os.remove(target)
+    # shutil.move is a plain rename when both paths are on the same file system
+    return shutil.move(src, target)
@@ -0,0 +1,197 @@
+import http.server
+import logging as log
+import threading
+import sqlite3
+import json
+import time
+import os
+
+DEFAULT_LEASE = 10 * 60
+MAX_ATTEMPTS = 3
+REMOTE_TIMEOUT = 60
+METHODS = ("put_all", "lease", "renew", "done", "fail", "seal", "counts")
+
+
+class WorkQueue:
+    # Units are leased for a while, the units of a worker that died are leased again once it runs out
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'queued', worker TEXT, expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, error TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS units_state ON units (state, expires)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def transaction(self, statements):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes never lease the same unit
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.db)
+                self.db.execute("COMMIT")
+                return result
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def put_all(self, units):
+        # A unit is (key, kind, payload), a key that is already queued or done is skipped
+        def put(db):
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO units (key, kind, payload) VALUES (?, ?, ?)",
+                [(key, kind, json.dumps(payload)) for key, kind, payload in units]
+            )
+            return db.total_changes - before
+
+        return self.transaction(put)
+
+    def lease(self, worker, count=1, ttl=DEFAULT_LEASE):
+        now = time.time()
+
+        def lease(db):
+            db.execute(
+                "UPDATE units SET state = 'failed', error = 'The lease expired too many times' "
+                "WHERE state = 'leased' AND expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS)
+            )
+            rows = db.execute(
+                "SELECT id, kind, payload FROM units "
+                "WHERE state = 'queued' OR (state = 'leased' AND expires < ?) ORDER BY id LIMIT ?", (now, count)
+            ).fetchall()
+            db.executemany(
+                "UPDATE units SET state = 'leased', worker = ?, expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker, now + ttl, row["id"]) for row in rows]
+            )
+            return [{"id": row["id"], "kind": row["kind"], "payload": json.loads(row["payload"])} for row in rows]
+
+        return self.transaction(lease)
+
+    def renew(self, worker, ids, ttl=DEFAULT_LEASE):
+        expires = time.time() + ttl
+        self.transaction(lambda db: db.executemany(
+            "UPDATE units SET expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            [(expires, id, worker) for id in ids]
+        ))
+
+    def done(self, worker, ids):
+        self.transaction(lambda db: db.executemany(
+            "UPDATE units SET state = 'done', error = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+            [(id, worker) for id in ids]
+        ))
+
+    def fail(self, worker, id, error):
+        # The unit goes back to the queue until it runs out of attempts
+        self.transaction(lambda db: db.execute(
+            "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ? "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (MAX_ATTEMPTS, str(error), id, worker)
+        ))
+
+    def seal(self, sealed=True):
+        # Workers stop once the queue is sealed and nothing is left in it
+        self.transaction(lambda db: db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', ?)", ("1" if sealed else "0",)
+        ))
+
+    def counts(self):
+        with self.lock:
+            rows = self.db.execute("SELECT state, COUNT(*) AS n FROM units GROUP BY state").fetchall()
+            sealed = self.db.execute("SELECT value FROM meta WHERE key = 'sealed'").fetchone()
+        counts = {row["state"]: row["n"] for row in rows}
+        counts["sealed"] = sealed is not None and sealed["value"] == "1"
+        return counts
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class RemoteQueue:
+    # The same interface as WorkQueue, served by the coordinator over HTTP
+    def __init__(self, url):
+        import requests
+
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def call(self, method, **args):
+        response = self.session.post("{}/{}".format(self.url, method), json=args, timeout=REMOTE_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def put_all(self, units):
+        return self.call("put_all", units=units)
+
+    def lease(self, worker, count=1, ttl=DEFAULT_LEASE):
+        return self.call("lease", worker=worker, count=count, ttl=ttl)
+
+    def renew(self, worker, ids, ttl=DEFAULT_LEASE):
+        self.call("renew", worker=worker, ids=ids, ttl=ttl)
+
+    def done(self, worker, ids):
+        self.call("done", worker=worker, ids=ids)
+
+    def fail(self, worker, id, error):
+        self.call("fail", worker=worker, id=id, error=str(error))
+
+    def seal(self, sealed=True):
+        self.call("seal", sealed=sealed)
+
+    def counts(self):
+        return self.call("counts")
+
+    def close(self):
+        self.session.close()
+
+
+class QueueHandler(http.server.BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        method = self.path.strip("/")
+        if not method in METHODS:
+            self.send_error(404)
+            return
+        try:
+            args = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            body = json.dumps(getattr(self.server.queue, method)(**args)).encode("utf-8")
+        except (ValueError, TypeError, sqlite3.Error) as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class QueueServer:
+    # There is no authentication, the address should only be reachable by the workers
+    def __init__(self, queue, address):
+        host, port = address.rsplit(":", 1)
+        self.server = http.server.ThreadingHTTPServer((host, int(port)), QueueHandler)
+        self.server.daemon_threads = True
+        self.server.queue = queue
+        self.thread = threading.Thread(target=self.server.serve_forever, name="queue-server", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def open_queue(location):
+    if location.startswith(("http://", "https://")):
+        return RemoteQueue(location)
+    return WorkQueue(os.path.expanduser(location))